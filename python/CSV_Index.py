@@ -0,0 +1,240 @@
+import os
+import pickle
+from array import array
+from bisect import bisect_left, bisect_right
+
+import CSV_Tools
+
+# converts values for sorted indexes
+KEY_TYPES = {"str": str, "num": float, "int": int}
+
+
+class ColumnIndex:
+    """
+    Per-column indexes of a table for repeated lookups without scanning every row.
+    Hash indexes map each value to its rows and answer equality and IN queries.
+    Sorted indexes keep the values in order and answer range queries.
+    Row ids are the row indexes in the CSV list the index was built from (the header is row 0).
+    Values are compared as strings, like CSV_Tools.attribute_filter, unless a sorted index has a key type.
+    """
+
+    def __init__(self, headers, row_count):
+        """
+        :param headers: List of column names
+        :param row_count: Number of rows, not including the header
+        """
+        self.headers = list(headers)
+        self.row_count = row_count
+        self.hash_indexes = {}
+        self.sorted_indexes = {}
+        # key type of each sorted index
+        self.sorted_types = {}
+        # size and modified time of the csv the index was built from, set by from_csv
+        self.source_stamp = None
+
+    @classmethod
+    def from_rows(cls, rows, hash_col_names=(), sorted_col_names=(), key_types=None):
+        """
+        Builds indexes from rows in one pass
+        :param rows: Iterable of rows, such as a 2D list or csv_stream. The first row must be the header row.
+        :param hash_col_names: Columns to build hash indexes for
+        :param sorted_col_names: Columns to build sorted indexes for
+        :param key_types: Dict of column name to "str", "num" or "int" for sorted indexes. Defaults to "str".
+                          Values that cannot be converted are left out of the sorted index.
+        :return: ColumnIndex
+        """
+        rows = iter(rows)
+        headers = next(rows)
+        key_types = key_types or {}
+        hash_cols = CSV_Tools.indexer(headers, list(hash_col_names))
+        sorted_cols = CSV_Tools.indexer(headers, list(sorted_col_names))
+        converters = []
+        for name in sorted_col_names:
+            key_type = key_types.get(name, "str")
+            if key_type not in KEY_TYPES:
+                raise ValueError("Unknown key type for " + str(name) + ": " + str(key_type))
+            converters.append(KEY_TYPES[key_type])
+
+        hashes = [{} for _ in hash_cols]
+        sorts = [[] for _ in sorted_cols]
+        row_id = 0
+        for row_id, row in enumerate(rows, 1):
+            for values, col in zip(hashes, hash_cols):
+                value = row[col] if col < len(row) else ""
+                row_ids = values.get(value)
+                if row_ids is None:
+                    values[value] = [row_id]
+                else:
+                    row_ids.append(row_id)
+            for pairs, col, convert in zip(sorts, sorted_cols, converters):
+                try:
+                    pairs.append((convert(row[col]), row_id))
+                except (ValueError, IndexError):
+                    continue
+
+        index = cls(headers, row_id)
+        for name, values in zip(hash_col_names, hashes):
+            index.hash_indexes[name] = {value: array("q", row_ids) for value, row_ids in values.items()}
+        for name, pairs, convert in zip(sorted_col_names, sorts, converters):
+            pairs.sort()
+            index.sorted_indexes[name] = (convert, [pair[0] for pair in pairs], array("q", [pair[1] for pair in pairs]))
+            index.sorted_types[name] = key_types.get(name, "str")
+        return index
+
+    @classmethod
+    def from_csv(cls, file_path, hash_col_names=(), sorted_col_names=(), key_types=None, index_path=None,
+                 delimiter=",", encoding="utf-8"):
+        """
+        Loads the sidecar index of a csv file, or builds and saves it if it is missing, out of date
+        or does not have the requested columns and key types. When columns are added to an up to date
+        sidecar, the columns it already had are kept.
+        :param file_path: Path of csv
+        :param hash_col_names: Columns that need hash indexes
+        :param sorted_col_names: Columns that need sorted indexes
+        :param key_types: Dict of column name to "str", "num" or "int" for sorted indexes
+        :param index_path: Path of sidecar file. Defaults to file_path + ".idx"
+        :param delimiter: CSV delimiter character
+        :param encoding: encoding of csv file
+        :return: ColumnIndex
+        """
+        if index_path is None:
+            index_path = file_path + ".idx"
+        stamp = _file_stamp(file_path)
+        sorted_types = {name: (key_types or {}).get(name, "str") for name in sorted_col_names}
+        hash_col_names = list(hash_col_names)
+
+        if os.path.exists(index_path):
+            try:
+                index = cls.load(index_path)
+            except (pickle.UnpicklingError, EOFError, TypeError, AttributeError):
+                index = None
+            if index is not None and index.source_stamp == stamp:
+                if (all(name in index.hash_indexes for name in hash_col_names) and
+                        all(index.sorted_types.get(name) == key_type for name, key_type in sorted_types.items())):
+                    return index
+                # keeps the columns the sidecar already has, with the requested key types taking priority
+                hash_col_names += [name for name in index.hash_indexes if name not in hash_col_names]
+                sorted_types = dict(index.sorted_types, **sorted_types)
+
+        index = cls.from_rows(CSV_Tools.csv_stream(file_path, delimiter, encoding), hash_col_names,
+                              list(sorted_types), sorted_types)
+        index.source_stamp = stamp
+        index.save(index_path)
+        return index
+
+    def equals(self, col_name, value):
+        """
+        Finds rows whose value in a column equals value
+        :param col_name: Column with a hash index
+        :param value: Value to find. Compared as a string.
+        :return: array of row ids, in row order
+        """
+        return self.hash_indexes[col_name].get(str(value), array("q"))
+
+    def isin(self, col_name, values):
+        """
+        Finds rows whose value in a column is one of several values
+        :param col_name: Column with a hash index
+        :param values: Values to find
+        :return: list of row ids, in row order
+        """
+        col_index = self.hash_indexes[col_name]
+        row_ids = []
+        for value in set(str(value) for value in values):
+            row_ids.extend(col_index.get(value, ()))
+        return sorted(row_ids)
+
+    def range(self, col_name, low=None, high=None, include_low=True, include_high=True):
+        """
+        Finds rows whose value in a column is between two values
+        :param col_name: Column with a sorted index
+        :param low: Lowest value. No lower bound if None.
+        :param high: Highest value. No upper bound if None.
+        :param include_low: False = leave out rows equal to low
+        :param include_high: False = leave out rows equal to high
+        :return: list of row ids, in row order
+        """
+        convert, values, row_ids = self.sorted_indexes[col_name]
+        start = 0
+        end = len(values)
+        if low is not None:
+            low = convert(low)
+            start = bisect_left(values, low) if include_low else bisect_right(values, low)
+        if high is not None:
+            high = convert(high)
+            end = bisect_right(values, high) if include_high else bisect_left(values, high)
+        return sorted(row_ids[start:end])
+
+    def find(self, conditions):
+        """
+        Finds rows that meet every condition
+        :param conditions: List of (col_name, operator, value). Operators:
+                           "=" and "in" use hash indexes. "<", "<=", ">", ">=" and "between" (value = (low, high))
+                           use sorted indexes.
+        :return: list of row ids, in row order
+        """
+        matches = []
+        for col_name, operator, value in conditions:
+            if operator == "=":
+                matches.append(self.equals(col_name, value))
+            elif operator == "in":
+                matches.append(self.isin(col_name, value))
+            elif operator == "between":
+                matches.append(self.range(col_name, value[0], value[1]))
+            elif operator in ("<", "<="):
+                matches.append(self.range(col_name, high=value, include_high=operator == "<="))
+            elif operator in (">", ">="):
+                matches.append(self.range(col_name, low=value, include_low=operator == ">="))
+            else:
+                raise ValueError("Unknown operator: " + str(operator))
+
+        if not matches:
+            return list(range(1, self.row_count + 1))
+
+        # intersects from the smallest match so the work follows the result size
+        matches.sort(key=len)
+        found = set(matches[0])
+        for row_ids in matches[1:]:
+            if not found:
+                break
+            found.intersection_update(row_ids)
+        return sorted(found)
+
+    def rows(self, csv_list, row_ids):
+        """
+        Looks up rows by id
+        :param csv_list: The CSV list the index was built from
+        :param row_ids: Row ids from equals, isin, range or find
+        :return: 2D list with the header row first
+        """
+        return [csv_list[0]] + [csv_list[row_id] for row_id in row_ids]
+
+    def save(self, file_path):
+        """
+        Saves the index so it can be reused without rebuilding it
+        :param file_path: Path of file to write to
+        :return: Writes index to file
+        """
+        with open(file_path, "wb") as index_file:
+            pickle.dump(self, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Loads an index written by save
+        :param file_path: Path of index file
+        :return: ColumnIndex
+        """
+        with open(file_path, "rb") as index_file:
+            index = pickle.load(index_file)
+        if not isinstance(index, cls):
+            raise TypeError(str(file_path) + " does not contain a " + cls.__name__)
+        return index
+
+
+def _file_stamp(file_path):
+    """
+    :return: (size, modified time in ns) of a file
+    """
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
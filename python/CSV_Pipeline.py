@@ -0,0 +1,170 @@
+from itertools import chain
+
+import CSV_Tools
+import KML_Build
+
+
+def _required(rows, col_names):
+    """
+    Drops rows that are missing a value in any of the columns
+    """
+    rows = iter(rows)
+    headers = next(rows)
+    yield headers
+    cols = CSV_Tools.indexer(headers, col_names)
+    for row in rows:
+        if all(col < len(row) and row[col] != "" for col in cols):
+            yield row
+
+
+def _where(rows, col_name, test):
+    """
+    Keeps rows whose value in a column passes a test
+    """
+    rows = iter(rows)
+    headers = next(rows)
+    yield headers
+    col = headers.index(col_name)
+    for row in rows:
+        if col < len(row) and test(row[col]):
+            yield row
+
+
+def _project(rows, col_names):
+    """
+    Keeps only some columns, in the given order
+    """
+    rows = iter(rows)
+    headers = next(rows)
+    cols = CSV_Tools.indexer(headers, col_names)
+    yield [headers[col] for col in cols]
+    for row in rows:
+        yield [row[col] if col < len(row) else "" for col in cols]
+
+
+class Pipeline:
+    """
+    Lazy chain of table operations. Each step returns a new Pipeline and nothing is read until a sink
+    (to_csv, to_kml, to_list or iterating) pulls rows through, one row at a time.
+    Steps run as each row is parsed, so memory does not grow with the size of the file.
+
+    Pipeline.from_csv("big.csv").required(["X", "Y"]).filter("Type", "Well").to_kml("wells.kml", ...)
+    """
+
+    def __init__(self, rows, steps=()):
+        """
+        :param rows: Iterable of rows, or a function that returns them. The first row must be the header row.
+        :param steps: Functions that take rows and return rows, applied in order
+        """
+        self.source = rows
+        self.steps = tuple(steps)
+
+    @classmethod
+    def from_csv(cls, file_path, delimiter=",", encoding="utf-8"):
+        """
+        Starts a pipeline that reads a csv file. The file is opened each time the pipeline runs.
+        :param file_path: full path to csv
+        :param delimiter: separation character
+        :param encoding: encoding of csv file
+        :return: Pipeline
+        """
+        return cls(lambda: CSV_Tools.csv_stream(file_path, delimiter, encoding))
+
+    def _then(self, step):
+        return Pipeline(self.source, self.steps + (step,))
+
+    def __iter__(self):
+        rows = self.source() if callable(self.source) else self.source
+        for step in self.steps:
+            rows = step(rows)
+        return iter(rows)
+
+    def required(self, col_names):
+        """
+        Drops rows that are missing a value, like CSV_Tools.required_fields
+        :param col_names: Names of the columns that should not be null
+        :return: Pipeline
+        """
+        return self._then(lambda rows: _required(rows, col_names))
+
+    def filter(self, col_name, target_value):
+        """
+        Keeps rows with a single value in a single column, like CSV_Tools.attribute_filter
+        :param col_name: The column that the target_value will exist in
+        :param target_value: The value that the rows will be filtered to
+        :return: Pipeline
+        """
+        target_value = str(target_value)
+        return self._then(lambda rows: _where(rows, col_name, lambda value: value == target_value))
+
+    def where(self, col_name, test):
+        """
+        Keeps rows whose value in a column passes a test
+        :param col_name: Column name
+        :param test: function that takes a value and returns True to keep the row
+        :return: Pipeline
+        """
+        return self._then(lambda rows: _where(rows, col_name, test))
+
+    def project(self, col_names):
+        """
+        Keeps only some columns, like CSV_Tools.column_reducer with remove=False
+        :param col_names: Names of the columns to keep, in output order
+        :return: Pipeline
+        """
+        return self._then(lambda rows: _project(rows, col_names))
+
+    def then(self, step):
+        """
+        Adds a step that takes rows and returns rows, header first, such as CSV_Tools.thin_points
+        :param step: function of rows
+        :return: Pipeline
+        """
+        return self._then(step)
+
+    def to_list(self):
+        """
+        Runs the pipeline into memory
+        :return: 2D list
+        """
+        return list(self)
+
+    def to_csv(self, file_path, delimiter=","):
+        """
+        Runs the pipeline into a csv file
+        :param file_path: Path of file to write to
+        :param delimiter: CSV delimiter character
+        :return: Writes rows to csv file
+        """
+        CSV_Tools.csv_writer(file_path, self, delimiter)
+
+    def to_kml(self, file_path, doc_name, folder_name, name_col_name, coord_col_names, styles=None,
+               altitude_mode="ctg", style_to_use=None, description=None, visibility=1, compact=False):
+        """
+        Runs the pipeline into a KML file of point placemarks with KML_Build.KMLWriter
+        :param file_path: Path of .kml file to write to
+        :param doc_name: Name of KML document
+        :param folder_name: Name of folder that will hold placemarks
+        :param name_col_name: Name of the column that contains placemark names
+        :param coord_col_names: List of x, y, z cols names : [x_col_name, y_col_name, z_col_name]
+        :param styles: A list of styles to include (Optional)
+        :param altitude_mode: Abbreviated altitude mode (Optional)
+        :param style_to_use: Name of point style to use (Optional)
+        :param description: Description of layer (Optional)
+        :param visibility: 1 = Visible, 0 = Invisible (Optional)
+        :param compact: True = Schema/SimpleData output. See KML_Build.placemarks. (Optional)
+        :return: Number of placemarks written
+        """
+        rows = iter(self)
+        headers = next(rows)
+        with open(file_path, "w") as kml_file:
+            with KML_Build.KMLWriter(kml_file, doc_name) as writer:
+                if styles:
+                    writer.write_styles(styles)
+                if compact:
+                    # the Schema has to be in the Document, ahead of the folder
+                    writer.write_styles(KML_Build.compact_styles(folder_name, headers, style_to_use))
+                writer.open_folder(folder_name, visibility, description)
+                count = writer.write_placemarks(chain([headers], rows), name_col_name, coord_col_names,
+                                                altitude_mode, style_to_use, visibility, compact)
+        return count
@@ -0,0 +1,241 @@
+from array import array
+
+# typed columns are stored in compact arrays instead of lists of strings
+COLUMN_TYPES = {"float": "d", "int": "q"}
+
+
+def _typed_column(name, values, column_type):
+    """
+    Converts a column of strings to an array
+    :param name: Column name, used in errors
+    :param values: Column values
+    :param column_type: "float" or "int". Blank floats become nan.
+    :return: array('d') or array('q')
+    """
+    if column_type not in COLUMN_TYPES:
+        raise ValueError("Unknown column type for " + str(name) + ": " + str(column_type))
+    try:
+        if column_type == "float":
+            return array("d", [float(value) if value != "" else float("nan") for value in values])
+        return array("q", [int(value) for value in values])
+    except ValueError:
+        raise ValueError("Column " + str(name) + " has values that are not " + column_type)
+
+
+def _sort_key(column, reverse):
+    """
+    Sort key for one column. nan values in float columns sort last in either direction.
+    :param column: list or array
+    :param reverse: True = descending
+    :return: function of a row position
+    """
+    if not (isinstance(column, array) and column.typecode == "d"):
+        return column.__getitem__
+    if reverse:
+        return lambda position: (column[position] == column[position], column[position])
+    return lambda position: (column[position] != column[position], column[position])
+
+
+class Table:
+    """
+    Table stored as one list or array per column instead of one list per row.
+    Selecting, filtering and sorting return views that share the columns, so rows are never copied.
+    A view keeps the positions of its rows in row_ids.
+    """
+
+    def __init__(self, headers, columns, row_ids=None):
+        """
+        :param headers: List of column names
+        :param columns: One list or array per column, all the same length
+        :param row_ids: Positions of the rows in the view. All rows if None.
+        """
+        self.headers = list(headers)
+        self.columns = list(columns)
+        self.row_ids = row_ids
+        self.header_index = {header: col for col, header in enumerate(self.headers)}
+
+    @classmethod
+    def from_rows(cls, rows, types=None):
+        """
+        Builds a table from rows, such as a 2D list or csv_stream. Short rows are padded with "".
+        :param rows: Iterable of rows. The first row must be the header row.
+        :param types: Dict of column name to "float" or "int" for columns to store as numbers (Optional)
+        :return: Table
+        """
+        rows = iter(rows)
+        headers = list(next(rows))
+        columns = [[] for _ in headers]
+        width = len(headers)
+
+        for row in rows:
+            if len(row) < width:
+                row = list(row) + [""] * (width - len(row))
+            for col in range(width):
+                columns[col].append(row[col])
+
+        for name, column_type in (types or {}).items():
+            col = headers.index(name)
+            columns[col] = _typed_column(name, columns[col], column_type)
+
+        return cls(headers, columns)
+
+    @classmethod
+    def from_csv_list(cls, csv_list, types=None):
+        """
+        Builds a table from a 2D list
+        :param csv_list: csv that has been converted to a 2D list.
+        :param types: Dict of column name to "float" or "int" (Optional)
+        :return: Table
+        """
+        return cls.from_rows(csv_list, types)
+
+    def __len__(self):
+        if self.row_ids is not None:
+            return len(self.row_ids)
+        return len(self.columns[0]) if self.columns else 0
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def __iter__(self):
+        """
+        Iterates like a CSV list, so a Table can be passed to csv_writer and the joins
+        :return: iterator of the header row, then each row
+        """
+        yield list(self.headers)
+        yield from self.rows()
+
+    def _positions(self):
+        """
+        :return: Positions of the rows in the view
+        """
+        if self.row_ids is not None:
+            return self.row_ids
+        return range(len(self))
+
+    def column(self, name):
+        """
+        Gets the values of a column
+        :param name: Column name
+        :return: The column itself for a full table, or a list of the selected values for a view
+        """
+        column = self.columns[self.header_index[name]]
+        if self.row_ids is None:
+            return column
+        return [column[position] for position in self.row_ids]
+
+    def rows(self):
+        """
+        Rebuilds rows one at a time
+        :return: generator of row lists, without the header
+        """
+        columns = self.columns
+        for position in self._positions():
+            yield [column[position] for column in columns]
+
+    def to_csv_list(self):
+        """
+        Converts the table to a 2D list with a header row
+        :return: 2D list
+        """
+        return [list(self.headers)] + list(self.rows())
+
+    def select(self, names):
+        """
+        Keeps only some columns
+        :param names: Column names, in output order
+        :return: Table view
+        """
+        return Table(names, [self.columns[self.header_index[name]] for name in names], self.row_ids)
+
+    def where(self, name, test):
+        """
+        Keeps rows whose value in a column passes a test
+        :param name: Column name
+        :param test: function that takes a value and returns True to keep the row
+        :return: Table view
+        """
+        column = self.columns[self.header_index[name]]
+        row_ids = array("q", [position for position in self._positions() if test(column[position])])
+        return Table(self.headers, self.columns, row_ids)
+
+    def where_equal(self, name, value):
+        """
+        Keeps rows whose value in a column equals value, like attribute_filter.
+        Values are compared as strings, except in float and int columns, where value is converted to the
+        column's type first. "" matches blank (nan) values in a float column.
+        :param name: Column name
+        :param value: Value to keep
+        :return: Table view
+        """
+        column = self.columns[self.header_index[name]]
+        if isinstance(column, array):
+            if column.typecode == "d" and str(value) == "":
+                return self.where(name, lambda cell: cell != cell)
+            convert = float if column.typecode == "d" else int
+            try:
+                value = convert(value)
+            except ValueError:
+                raise ValueError("Column " + str(name) + " holds numbers and " + repr(value) + " is not one")
+            return self.where(name, lambda cell: cell == value)
+
+        value = str(value)
+        return self.where(name, lambda cell: str(cell) == value)
+
+    def sort(self, names, reverse=False):
+        """
+        Sorts rows by one or more columns. Ties keep their order. Blank (nan) float values sort last.
+        :param names: Column name, or a list of names
+        :param reverse: True = descending
+        :return: Table view
+        """
+        if isinstance(names, str):
+            names = [names]
+        keys = [_sort_key(self.columns[self.header_index[name]], reverse) for name in names]
+        if len(keys) == 1:
+            key = keys[0]
+        else:
+            def key(position):
+                return tuple(column_key(position) for column_key in keys)
+        row_ids = array("q", sorted(self._positions(), key=key, reverse=reverse))
+        return Table(self.headers, self.columns, row_ids)
+
+    def sort_by(self, key, reverse=False):
+        """
+        Sorts rows with a key function of the row, like CSV_Tools.csv_sort does for a 2D list. Ties keep their order.
+        :param key: function that takes a row list and returns a sort key
+        :param reverse: True = descending
+        :return: Table view
+        """
+        columns = self.columns
+
+        def position_key(position):
+            return key([column[position] for column in columns])
+
+        row_ids = array("q", sorted(self._positions(), key=position_key, reverse=reverse))
+        return Table(self.headers, self.columns, row_ids)
+
+    def unique(self, name):
+        """
+        Finds the distinct values in a column, leaving out blanks. Blank float values are nan.
+        :param name: Column name
+        :return: sorted list of values
+        """
+        # nan != nan, so blank floats are dropped by the same test as ""
+        return sorted(set(value for value in self.column(name) if value != "" and value == value))
+
+    def first_rows(self, name):
+        """
+        Keeps the first row for each distinct value in a column, leaving out blanks. Blank float values are nan.
+        :param name: Column name
+        :return: Table view
+        """
+        column = self.columns[self.header_index[name]]
+        seen = {""}
+        row_ids = array("q")
+        for position in self._positions():
+            value = column[position]
+            if value not in seen and value == value:
+                seen.add(value)
+                row_ids.append(position)
+        return Table(self.headers, self.columns, row_ids)
@@ -1,5 +1,19 @@
 import csv
+import hashlib
+import heapq
+import json
 import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from itertools import chain, islice
+from math import isfinite
+from multiprocessing import Pool
+
+import CSV_Table
+import GIS_Basics
+import Spatial_Index
 
 
 def csv_reader(file_path, delimiter=",", encoding="utf-8"):
@@ -15,15 +29,28 @@ def csv_reader(file_path, delimiter=",", encoding="utf-8"):
         return list(csv.reader(file, delimiter=delimiter))
 
 
-def csv_writer(file_path, list_to_write, delimiter=","):
+def csv_stream(file_path, delimiter=",", encoding="utf-8"):
+    """
+    Reads a csv file one row at a time. The file stays open until every row is read.
+    :param file_path: full path to csv
+    :param delimiter: separation character
+    :param encoding: encoding of csv file
+    :return: generator of rows, header first
+    """
+    with open(file_path, encoding=encoding, newline="") as file:
+        yield from csv.reader(file, delimiter=delimiter)
+
+
+def csv_writer(file_path, list_to_write, delimiter=",", encoding=None):
     """
     Writes 2D list to csv. Will create file if it does not exist.
     :param file_path: Path of file to write to
-    :param list_to_write: List to write to csv
+    :param list_to_write: List to write to csv, or a CSV_Table.Table
     :param delimiter: CSV delimiter character
+    :param encoding: encoding of csv file. Defaults to the system encoding.
     :return: Writes list to csv file
     """
-    with open(file_path, "w") as csv_out:
+    with open(file_path, "w", encoding=encoding) as csv_out:
         writer = csv.writer(csv_out, delimiter=delimiter, lineterminator='\n')
         for i in list_to_write:
             writer.writerow(i)
@@ -58,7 +85,7 @@ def csv_combine(folder_path):
     Each csv must have same number of headers.
     Columns must be identically ordered.
 
-    :param folder_path: Path to folder without trailing "\\"
+    :param folder_path: Path to folder
     :return: 2D list of combined csv files
     """
     csv_combined = []
@@ -66,7 +93,7 @@ def csv_combine(folder_path):
     count = 0
     for fileName in os.listdir(folder_path):
         if fileName.endswith(".csv"):
-            file_path = folder_path + "\\" + fileName
+            file_path = os.path.join(folder_path, fileName)
 
             # append whole first csv to retain header rows
             if count == 0:
@@ -90,12 +117,227 @@ def csv_combine(folder_path):
                     row.append(str(fileName))
 
                 csv_combined.extend(csv_list[1:])
-        count += 1
+            count += 1
 
     # print(str(count) + " CSVs combined")
     return csv_combined
 
 
+def _read_csv_file(file_path, delimiter=",", encoding="utf-8"):
+    """
+    Reads one csv for csv_combine_file. Runs in a worker thread or process.
+    :return: (header row, data rows)
+    """
+    csv_list = csv_reader(file_path, delimiter, encoding)
+    if not csv_list:
+        return [], []
+    return csv_list[0], csv_list[1:]
+
+
+def csv_combine_file(folder_path, out_path, workers=None, processes=False, header_mismatch="raise",
+                     expected_header=None, delimiter=",", encoding="utf-8"):
+    """
+    Combines all CSVs within a folder into one csv file, with a "SourceFile" column like csv_combine.
+    Files are read in parallel and written in file name order. At most two files per worker
+    are held in memory at a time, so memory does not grow with the number of files.
+    :param folder_path: Path to folder
+    :param out_path: Path of combined csv to write. Skipped if it is inside folder_path.
+    :param workers: Number of threads or processes. Defaults to the number of cores.
+    :param processes: False = threads, for when reading is limited by the disk /
+                      True = processes, for when parsing is limited by the CPU
+    :param header_mismatch: "raise" = raise ValueError when a header does not match / "skip" = leave the file out
+    :param expected_header: Header every file must have. Defaults to the header of the first file.
+    :param delimiter: CSV delimiter character
+    :param encoding: encoding of csv files
+    :return: dict of "files" (number combined), "rows" (number of rows written) and "skipped" (file names)
+    """
+    if header_mismatch not in ("raise", "skip"):
+        raise ValueError("Unknown header_mismatch: " + str(header_mismatch))
+
+    out_path = os.path.abspath(out_path)
+    file_names = sorted(file_name for file_name in os.listdir(folder_path) if file_name.endswith(".csv") and
+                        os.path.abspath(os.path.join(folder_path, file_name)) != out_path)
+    with open(out_path, "w", encoding=encoding) as csv_out:
+        if expected_header is not None:
+            expected_header = list(expected_header)
+            csv.writer(csv_out, delimiter=delimiter, lineterminator='\n').writerow(expected_header + ["SourceFile"])
+        summary = _combine_into(csv_out, folder_path, file_names, expected_header, workers, processes,
+                                header_mismatch, delimiter, encoding)
+    del summary["header"]
+    return summary
+
+
+def _combine_into(csv_out, folder_path, file_names, header, workers, processes, header_mismatch, delimiter,
+                  encoding):
+    """
+    Reads csv files in parallel and writes their rows to an open file, in the order of file_names.
+    :param csv_out: Text file object to write to
+    :param header: Header every file must have. Taken from the first file and written to csv_out if None.
+                   Not written when given.
+    :return: dict of "files", "rows", "skipped" and "header"
+    """
+    workers = workers or os.cpu_count() or 1
+    executor_type = ProcessPoolExecutor if processes else ThreadPoolExecutor
+
+    summary = {"files": 0, "rows": 0, "skipped": []}
+    with executor_type(workers) as executor:
+        writer = csv.writer(csv_out, delimiter=delimiter, lineterminator='\n')
+
+        def submit(file_name):
+            return executor.submit(_read_csv_file, os.path.join(folder_path, file_name), delimiter, encoding).result
+
+        for file_name, (file_header, rows) in bounded_imap(submit, file_names, 2 * workers):
+            if header is None:
+                header = list(file_header)
+                writer.writerow(header + ["SourceFile"])
+            elif list(file_header) != list(header):
+                if header_mismatch == "raise":
+                    raise ValueError(file_name + " header does not match: " + str(file_header))
+                summary["skipped"].append(file_name)
+                continue
+
+            for row in rows:
+                row.append(file_name)
+            writer.writerows(rows)
+            summary["files"] += 1
+            summary["rows"] += len(rows)
+
+    summary["header"] = header
+    return summary
+
+
+def bounded_imap(submit, items, window):
+    """
+    Runs items through a process or thread pool and yields the results in the same order as items.
+    Unlike Pool.imap, only window items are read ahead of the one being used, so memory does not grow with the
+    length of items when the workers are slower than the input.
+    :param submit: function that starts the work for one item and returns a function that waits for its result,
+                   such as lambda item: pool.apply_async(func, (item,)).get
+                   or lambda item: executor.submit(func, item).result
+    :param items: iterable of items
+    :param window: Most items in flight at once, such as twice the number of workers
+    :return: generator of (item, result)
+    """
+    items = iter(items)
+    pending = deque((item, submit(item)) for item in islice(items, window))
+    while pending:
+        item, wait = pending.popleft()
+        result = wait()
+        # keeps the window full while this result is used
+        for next_item in islice(items, 1):
+            pending.append((next_item, submit(next_item)))
+        yield item, result
+
+
+def _pool_window(processes):
+    """
+    :return: number of chunks to keep in flight for a Pool(processes)
+    """
+    return 2 * (processes or os.cpu_count() or 1)
+
+
+def _file_hash(file_path):
+    """
+    :return: sha256 of a file's contents as hex
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def csv_combine_incremental(folder_path, out_path, manifest_path=None, workers=None, processes=False,
+                            header_mismatch="raise", delimiter=",", encoding="utf-8"):
+    """
+    Keeps a combined csv from csv_combine_file up to date without re-reading files it already holds.
+    A JSON manifest next to the output records the size, modified time and sha256 of every file combined.
+    New files are appended. If a combined file changed or was deleted, or the output does not match the
+    manifest, everything is rebuilt. A file whose time changed but whose hash did not counts as unchanged.
+    Appended files come after the existing rows, so after appends the output is no longer in file name order.
+    :param folder_path: Path to folder
+    :param out_path: Path of combined csv. Skipped if it is inside folder_path.
+    :param manifest_path: Path of manifest. Defaults to out_path + ".manifest.json"
+    :param workers: Number of threads or processes. See csv_combine_file.
+    :param processes: False = threads / True = processes. See csv_combine_file.
+    :param header_mismatch: "raise" or "skip". Skipped files are recorded so they are not read again until they change.
+    :param delimiter: CSV delimiter character
+    :param encoding: encoding of csv files
+    :return: dict of "action" ("rebuild", "append" or "none"), "added", "changed", "deleted" and "skipped"
+             (file names) and "rows" (number of rows written)
+    """
+    if header_mismatch not in ("raise", "skip"):
+        raise ValueError("Unknown header_mismatch: " + str(header_mismatch))
+    if manifest_path is None:
+        manifest_path = out_path + ".manifest.json"
+
+    manifest = None
+    if os.path.exists(manifest_path) and os.path.exists(out_path):
+        with open(manifest_path, encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+        # a run that stopped part way leaves the output out of step with the manifest
+        if os.path.getsize(out_path) != manifest["output_size"]:
+            manifest = None
+    old_files = manifest["files"] if manifest is not None else {}
+
+    abs_out_path = os.path.abspath(out_path)
+    current = {}
+    for file_name in sorted(os.listdir(folder_path)):
+        file_path = os.path.join(folder_path, file_name)
+        if file_name.endswith(".csv") and os.path.abspath(file_path) != abs_out_path:
+            stat = os.stat(file_path)
+            current[file_name] = {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    report = {"action": "none", "added": [], "changed": [], "deleted": [], "skipped": [], "rows": 0}
+    for file_name, entry in current.items():
+        old_entry = old_files.get(file_name)
+        if old_entry is None:
+            report["added"].append(file_name)
+            entry["sha256"] = _file_hash(os.path.join(folder_path, file_name))
+            continue
+        entry["skipped"] = old_entry.get("skipped", False)
+        if entry["size"] == old_entry["size"] and entry["mtime"] == old_entry["mtime"]:
+            entry["sha256"] = old_entry["sha256"]
+            continue
+        entry["sha256"] = _file_hash(os.path.join(folder_path, file_name))
+        if entry["sha256"] != old_entry["sha256"]:
+            report["changed"].append(file_name)
+    report["deleted"] = sorted(set(old_files) - set(current))
+
+    if manifest is None or report["changed"] or report["deleted"]:
+        report["action"] = "rebuild"
+        file_names = list(current)
+        with open(out_path, "w", encoding=encoding) as csv_out:
+            summary = _combine_into(csv_out, folder_path, file_names, None, workers, processes, header_mismatch,
+                                    delimiter, encoding)
+        for file_name in file_names:
+            current[file_name]["skipped"] = False
+    elif report["added"]:
+        report["action"] = "append"
+        file_names = report["added"]
+        with open(out_path, "a", encoding=encoding) as csv_out:
+            summary = _combine_into(csv_out, folder_path, file_names, manifest["header"], workers, processes,
+                                    header_mismatch, delimiter, encoding)
+        for file_name in file_names:
+            current[file_name]["skipped"] = False
+    else:
+        # still saves the manifest so files whose time changed are not hashed again
+        summary = {"header": manifest["header"], "rows": 0, "skipped": []}
+
+    for file_name in summary["skipped"]:
+        current[file_name]["skipped"] = True
+    report["skipped"] = [file_name for file_name, entry in current.items() if entry["skipped"]]
+    report["rows"] = summary["rows"]
+
+    manifest = {"header": summary["header"], "output_size": os.path.getsize(out_path), "files": current}
+    # replaces the manifest in one step so a failed run cannot leave half of it
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    return report
+
+
 def single_header(csv_list, header_rows, title_row):
     """
     For CSVs with multiple header rows. Removes all but one header row.
@@ -124,18 +366,19 @@ def indexer(header_list, cols_to_index):
 def required_fields(csv_list, cols_to_check):
     """
     Removes any rows that are missing a required value
-    :param csv_list: csv that has been converted to a 2D list.
+    :param csv_list: csv that has been converted to a 2D list, or a CSV_Table.Table
     :param cols_to_check: Column indexes of the columns that should not be null
-    :return: A 2D list with only records that contain all required values
+    :return: A 2D list with only records that contain all required values.
+             A Table view for a Table, where blank (nan) float values are also missing.
     """
-    rows_to_remove = []
-    new_csv_list = []
-    for row in csv_list[1:]:
+    if isinstance(csv_list, CSV_Table.Table):
         for col in cols_to_check:
-            if row[col] == "" and row not in rows_to_remove:
-                rows_to_remove.append(row)
-    for row in csv_list:
-        if row not in rows_to_remove:
+            csv_list = csv_list.where(csv_list.headers[col], lambda value: value != "" and value == value)
+        return csv_list
+
+    new_csv_list = [csv_list[0]]
+    for row in csv_list[1:]:
+        if all(row[col] != "" for col in cols_to_check):
             new_csv_list.append(row)
     return new_csv_list
 
@@ -143,11 +386,18 @@ def required_fields(csv_list, cols_to_check):
 def column_reducer(csv_list, cols, remove=True):
     """
     Reduces number of columns in a csv
-    :param csv_list: csv that has been converted to a 2D list.
+    :param csv_list: csv that has been converted to a 2D list, or a CSV_Table.Table
     :param cols: Column indexes to remove or retain
     :param remove: [True  = Remove]  [False = Retain]
-    :return: a copy with unwanted columns removed
+    :return: a copy with unwanted columns removed. A Table view for a Table.
     """
+    if isinstance(csv_list, CSV_Table.Table):
+        headers = csv_list.headers
+        # keeps the table's own column order, like the 2D list path
+        if remove is False:
+            return csv_list.select([headers[col] for col in range(len(headers)) if col in cols])
+        return csv_list.select([headers[col] for col in range(len(headers)) if col not in cols])
+
     if remove is False:
         remove_cols = []
         keep_cols = cols
@@ -166,142 +416,661 @@ def column_reducer(csv_list, cols, remove=True):
 
 def unique_col_values(csv_list, col_name, records=False):
     """
-    :param csv_list: input csv file as a list.
+    :param csv_list: input csv file as a list, or a CSV_Table.Table
     :param col_name: Column to filter to unique
     :param records: FALSE sets the function to return a list of the unique values within a column.
                     TRUE sets the function to return a copy of the input where each row is the first row that the
                     unique value appears in.
-    :return: Either a 1D list or 2D list depending on "records" variable is set to.
+    :return: Either a 1D list or 2D list depending on "records" variable is set to. A Table view for a Table.
     """
-    name_col_index = indexer(csv_list[0], [str(col_name)])
-    col_values = [x[name_col_index[0]] for x in csv_list[1:] if x[name_col_index[0]] is not ""]
-    unique_value_list = sorted(set(col_values))
+    if isinstance(csv_list, CSV_Table.Table):
+        if records is True:
+            return csv_list.first_rows(str(col_name))
+        return csv_list.unique(str(col_name))
+
+    name_col_index = indexer(csv_list[0], [str(col_name)])[0]
 
     if records is False:
-        value_list = unique_value_list
-        return value_list
+        return sorted({x[name_col_index] for x in csv_list[1:]} - {""})
 
     if records is True:
         # takes first record where unique value appears
-        records_unique_val = []
-        unique_used = []
+        records_unique_val = [csv_list[0]]
+        unique_used = {""}
         for row in csv_list[1:]:
-            if row[name_col_index[0]] in unique_value_list and row[name_col_index[0]] not in unique_used:
+            if row[name_col_index] not in unique_used:
                 records_unique_val.append(row)
-                unique_used.append(row[name_col_index[0]])
+                unique_used.add(row[name_col_index])
+        return records_unique_val
+
+
+AGGREGATIONS = ("count", "sum", "min", "max", "mean", "first", "last", "distinct")
+
+
+def _number(value):
+    """
+    :return: value as a float, or None if it is not a number
+    """
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def _group_chunk(chunk):
+    """
+    Aggregates one chunk of rows into partial results. Runs in a worker process when group_by uses processes.
+    :param chunk: (rows, key column indexes, [(aggregation, column index)])
+    :return: dict of group key to list of partial results, in the order groups first appear
+    """
+    rows, key_cols, specs = chunk
+    groups = {}
+    for row in rows:
+        key = tuple(row[col] for col in key_cols)
+        states = groups.get(key)
+        if states is None:
+            states = groups[key] = [None] * len(specs)
+            first_row = True
+        else:
+            first_row = False
+
+        for position, (aggregation, col) in enumerate(specs):
+            if aggregation == "count":
+                states[position] = (states[position] or 0) + 1
+                continue
+            value = row[col]
+            if aggregation == "first":
+                if first_row:
+                    states[position] = value
+            elif aggregation == "last":
+                states[position] = value
+            elif aggregation == "distinct":
+                if first_row:
+                    states[position] = set()
+                states[position].add(value)
             else:
-                pass
-        records_unique_val.insert(0, csv_list[0])
-        value_list = records_unique_val
-        return value_list
+                number = _number(value)
+                state = states[position]
+                if number is None:
+                    continue
+                if aggregation == "sum":
+                    states[position] = number if state is None else state + number
+                elif aggregation == "mean":
+                    states[position] = [number, 1] if state is None else [state[0] + number, state[1] + 1]
+                elif aggregation == "min":
+                    states[position] = number if state is None or number < state else state
+                elif aggregation == "max":
+                    states[position] = number if state is None or number > state else state
+    return groups
+
+
+def _merge_groups(groups, partial, specs):
+    """
+    Adds the partial results of a later chunk to the results so far
+    :param groups: dict of group key to partial results. Changed in place.
+    :param partial: dict of group key to partial results from _group_chunk
+    :param specs: [(aggregation, column index)]
+    :return: Merges partial into groups
+    """
+    for key, partial_states in partial.items():
+        states = groups.get(key)
+        if states is None:
+            groups[key] = partial_states
+            continue
+        for position, (aggregation, col) in enumerate(specs):
+            state = states[position]
+            new_state = partial_states[position]
+            if new_state is None or aggregation == "first":
+                continue
+            if state is None or aggregation == "last":
+                states[position] = new_state
+            elif aggregation in ("count", "sum"):
+                states[position] = state + new_state
+            elif aggregation == "mean":
+                states[position] = [state[0] + new_state[0], state[1] + new_state[1]]
+            elif aggregation == "min":
+                states[position] = min(state, new_state)
+            elif aggregation == "max":
+                states[position] = max(state, new_state)
+            elif aggregation == "distinct":
+                state.update(new_state)
 
 
-def csv_sort(csv_list, sort_col_name):
+def group_by(rows, group_col_names, aggregations, processes=1, chunk_size=100000):
+    """
+    Groups rows by one or more columns and summarizes each group in a single pass over a dict of groups.
+    Rows are streamed, so a csv_stream of a file larger than memory can be grouped as long as the groups fit.
+    sum, mean, min and max skip values that are not numbers.
+    :param rows: Iterable of rows, such as a 2D list or csv_stream. The first row must be the header row.
+    :param group_col_names: Column name, or a list of names to group by
+    :param aggregations: List of (output column name, aggregation, column name). Aggregation is one of "count",
+                         "sum", "min", "max", "mean", "first", "last" or "distinct" (number of distinct values).
+                         The column name is not used by "count".
+    :param processes: Number of worker processes that aggregate chunks of rows. 1 = no process pool,
+                      None = all cores
+    :param chunk_size: Number of rows sent to a worker at a time
+    :return: 2D list with the group columns and one column per aggregation, groups in the order they first appear.
+             Empty groups of sum, mean, min and max are "".
+    """
+    rows = iter(rows)
+    headers = next(rows)
+    if isinstance(group_col_names, str):
+        group_col_names = [group_col_names]
+    key_cols = indexer(headers, group_col_names)
+
+    specs = []
+    for name, aggregation, col_name in aggregations:
+        if aggregation not in AGGREGATIONS:
+            raise ValueError("Unknown aggregation for " + str(name) + ": " + str(aggregation))
+        specs.append((aggregation, None if aggregation == "count" else headers.index(col_name)))
+
+    chunks = ((chunk, key_cols, specs) for chunk in iter(lambda: list(islice(rows, chunk_size)), []))
+    groups = {}
+    if processes == 1:
+        for chunk in chunks:
+            _merge_groups(groups, _group_chunk(chunk), specs)
+    else:
+        with Pool(processes) as pool:
+            for _, partial in bounded_imap(lambda chunk: pool.apply_async(_group_chunk, (chunk,)).get, chunks,
+                                           _pool_window(processes)):
+                _merge_groups(groups, partial, specs)
+
+    grouped_table = [list(group_col_names) + [name for name, aggregation, col_name in aggregations]]
+    for key, states in groups.items():
+        out_row = list(key)
+        for (aggregation, col), state in zip(specs, states):
+            if aggregation == "mean":
+                state = state[0] / state[1] if state is not None else None
+            elif aggregation == "distinct":
+                state = len(state)
+            out_row.append("" if state is None else state)
+        grouped_table.append(out_row)
+
+    return grouped_table
+
+
+def _sort_key(headers, sort_col_names, key_types=None, reverse=False):
+    """
+    Creates a sort key function for rows
+    :param headers: List of column names
+    :param sort_col_names: Column name, or a list of names. Earlier columns sort first.
+    :param key_types: Dict of column name to "str", "num", "int", "date" (ISO 8601) or a function that converts
+                      a value. Columns not listed sort as strings. Values that cannot be converted sort last.
+    :param reverse: True = the key is used for a descending sort, so values that cannot be converted still sort last
+    :return: function of row
+    """
+    if isinstance(sort_col_names, str):
+        sort_col_names = [sort_col_names]
+    key_types = key_types or {}
+
+    converters = {"str": str, "num": float, "int": int, "date": datetime.fromisoformat}
+    cols = []
+    for name in sort_col_names:
+        key_type = key_types.get(name, "str")
+        if not callable(key_type):
+            if key_type not in converters:
+                raise ValueError("Unknown key type for " + str(name) + ": " + str(key_type))
+            key_type = converters[key_type]
+        cols.append((headers.index(name), key_type))
+
+    if len(cols) == 1 and cols[0][1] is str:
+        sort_col = cols[0][0]
+        return lambda row: row[sort_col]
+
+    missing = (-1, "") if reverse else (1, "")
+
+    def key(row):
+        values = []
+        for col, convert in cols:
+            try:
+                values.append((0, convert(row[col])))
+            except (ValueError, IndexError):
+                values.append(missing)
+        return values
+
+    return key
+
+
+def csv_sort(csv_list, sort_col_name, key_types=None, reverse=False):
     """
     Sorts a csv by a column
-    :param csv_list: csv that has been converted to a 2D list.
-    :param sort_col_name: Name of column that will be sorted
-    :return: sorted csv list
-    """
-    # stores header since they will be removed below
-    csv_headers = [csv_list[0]]
-    # indexes sort col
-    sort_col = csv_headers[0].index(sort_col_name)
-    # sorts csv list sans headers
-    csv_sorted = sorted(csv_list[1:], key=lambda x: x[sort_col])
-    # empties csvList so that headers and csvSorted can be re-added in order
-    csv_list = []
-    # appends headers
-    for row in csv_headers:
-        csv_list.append(row)
-        # appends sorted csv rows
-    for row in csv_sorted:
-        csv_list.append(row)
+    :param csv_list: csv that has been converted to a 2D list, or a CSV_Table.Table
+    :param sort_col_name: Name of column that will be sorted, or a list of names
+    :param key_types: Dict of column name to "str", "num", "int" or "date". See csv_sort_file. (Optional)
+    :param reverse: True = descending (Optional)
+    :return: sorted csv list. A Table view for a Table.
+    """
+    if isinstance(csv_list, CSV_Table.Table):
+        if not key_types:
+            return csv_list.sort(sort_col_name, reverse)
+        return csv_list.sort_by(_sort_key(csv_list.headers, sort_col_name, key_types, reverse), reverse)
 
-    return csv_list
+    key = _sort_key(csv_list[0], sort_col_name, key_types, reverse)
+    return [csv_list[0]] + sorted(csv_list[1:], key=key, reverse=reverse)
+
+
+def _row_size(row):
+    """
+    Rough number of bytes a row of strings takes in memory
+    """
+    return 120 + sum([57 + len(cell) for cell in row])
+
+
+def csv_sort_file(in_path, out_path, sort_col_names, key_types=None, reverse=False, memory_bytes=256 * 1024 * 1024,
+                  delimiter=",", encoding="utf-8", temp_dir=None):
+    """
+    Sorts a csv file that may be larger than memory.
+    Rows are read in chunks that fit in memory_bytes. Each chunk is sorted and spilled to a temporary file,
+    and the chunks are merged with heapq.merge. Rows with equal keys keep their order.
+    :param in_path: Path of csv to sort
+    :param out_path: Path of sorted csv to write. Must not be in_path.
+    :param sort_col_names: Column name, or a list of names. Earlier columns sort first.
+    :param key_types: Dict of column name to "str", "num", "int", "date" (ISO 8601) or a function that converts
+                      a value, such as lambda v: datetime.strptime(v, "%m/%d/%Y"). Columns not listed sort as
+                      strings. Values that cannot be converted sort last. (Optional)
+    :param reverse: True = descending (Optional)
+    :param memory_bytes: Rough memory budget for each in-memory chunk (Optional)
+    :param delimiter: CSV delimiter character
+    :param encoding: encoding of csv file
+    :param temp_dir: Folder for the temporary chunk files. Defaults to the system temp folder. (Optional)
+    :return: Number of rows sorted, not including the header
+    """
+    rows = csv_stream(in_path, delimiter, encoding)
+    headers = next(rows)
+    key = _sort_key(headers, sort_col_names, key_types, reverse)
 
+    with tempfile.TemporaryDirectory(dir=temp_dir) as spill_dir:
+        chunk_paths = []
+        chunk = []
+        chunk_size = 0
+        row_count = 0
+        for row in rows:
+            chunk.append(row)
+            chunk_size += _row_size(row)
+            row_count += 1
+            if chunk_size >= memory_bytes:
+                chunk.sort(key=key, reverse=reverse)
+                chunk_paths.append(os.path.join(spill_dir, str(len(chunk_paths)) + ".csv"))
+                csv_writer(chunk_paths[-1], chunk, delimiter, encoding)
+                chunk = []
+                chunk_size = 0
+        chunk.sort(key=key, reverse=reverse)
 
-def attribute_filter(csv_list, target_value, target_col_name):
+        # every chunk was sorted the same way, so merging them keeps the order
+        chunk_streams = [csv_stream(chunk_path, delimiter, encoding) for chunk_path in chunk_paths]
+        merged = heapq.merge(*chunk_streams, chunk, key=key, reverse=reverse)
+        csv_writer(out_path, chain([headers], merged), delimiter, encoding)
+
+    return row_count
+
+
+def attribute_filter(csv_list, target_value, target_col_name, index=None):
     """
     Filter a 2D table by a single value in a single column.
 
-    :param csv_list: A 2D Table converted to a list
+    :param csv_list: A 2D Table converted to a list, or a CSV_Table.Table
     :param target_value: The value that the list will be filtered to
     :param target_col_name: The column that the target_value will exist in
-    :return: a filtered copy of in_list
+    :param index: CSV_Index.ColumnIndex of csv_list with a hash index on target_col_name.
+                  Only the matching rows are read. (Optional)
+    :return: a filtered copy of in_list. A Table view for a Table.
     """
+    if isinstance(csv_list, CSV_Table.Table):
+        return csv_list.where_equal(target_col_name, target_value)
+
+    if index is not None:
+        return index.rows(csv_list, index.equals(target_col_name, target_value))
+
     headers = csv_list[0]
     target_col_index = headers.index(target_col_name)
+    target_value = str(target_value)
 
     filtered_list = [headers]
-    for row in csv_list:
-        if str(row[target_col_index]) == str(target_value):
+    for row in csv_list[1:]:
+        if str(row[target_col_index]) == target_value:
             filtered_list.append(row)
 
     return filtered_list
 
 
+def _key_cols(header_list, keys):
+    """
+    Indexes the key columns of a join
+    :param header_list: A list of all column names
+    :param keys: Key column name, or a list of names for a composite key
+    :return: A list of column index values
+    """
+    if isinstance(keys, str):
+        keys = [keys]
+    return indexer(header_list, list(keys))
+
+
+def hash_join_rows(p_rows, f_rows, p_keys, f_keys, how="left", insert_w_pkey=False):
+    """
+    Joins two tables by building a dict of the foreign table once, so each primary row is a single lookup.
+    The primary table is streamed, so it can be read straight from disk with csv_stream and written with csv_writer.
+    Keys are compared as strings. Only the first foreign row for each key is used and the foreign key
+    columns are left out of the output. Neither input is changed.
+    :param p_rows: Primary table. Iterable of rows, header first.
+    :param f_rows: Foreign table. Iterable of rows, header first. Held in memory.
+    :param p_keys: Primary key column name, or a list of names for a composite key
+    :param f_keys: Foreign key column name, or a list of names in the same order as p_keys
+    :param how: "left" = keep every primary row / "inner" = only rows with a match /
+                "anti" = only primary rows without a match, with no foreign columns
+    :param insert_w_pkey: False = append / True = insert after the (first) primary key column
+    :return: generator of joined rows, header first. Unmatched left join rows are padded with "".
+    """
+    if how not in ("left", "inner", "anti"):
+        raise ValueError("Unknown join: " + str(how))
+
+    p_rows = iter(p_rows)
+    f_rows = iter(f_rows)
+    p_headers = next(p_rows)
+    f_headers = next(f_rows)
+    p_key_cols = _key_cols(p_headers, p_keys)
+    f_key_cols = _key_cols(f_headers, f_keys)
+    if len(p_key_cols) != len(f_key_cols):
+        raise ValueError("p_keys and f_keys must have the same number of columns")
+
+    # removes the foreign key cols from appearing in final join
+    f_cols = [col for col in range(len(f_headers)) if col not in f_key_cols]
+
+    # only keeps first occurrence of each foreign key
+    f_lookup = {}
+    for f_row in f_rows:
+        key = tuple(str(f_row[col]) for col in f_key_cols)
+        if key not in f_lookup:
+            f_lookup[key] = [f_row[col] for col in f_cols]
+
+    insert_at = p_key_cols[0] + 1 if insert_w_pkey else None
+
+    def joined(p_row, f_values):
+        if insert_at is None:
+            return list(p_row) + f_values
+        return list(p_row[:insert_at]) + f_values + list(p_row[insert_at:])
+
+    if how == "anti":
+        yield list(p_headers)
+    else:
+        yield joined(p_headers, [f_headers[col] for col in f_cols])
+
+    no_match = [""] * len(f_cols)
+    for p_row in p_rows:
+        f_values = f_lookup.get(tuple(str(p_row[col]) for col in p_key_cols))
+        if how == "anti":
+            if f_values is None:
+                yield list(p_row)
+        elif f_values is not None:
+            yield joined(p_row, f_values)
+        elif how == "left":
+            yield joined(p_row, no_match)
+
+
+def hash_join(p_table, f_table, p_keys, f_keys, how="left", insert_w_pkey=False):
+    """
+    Joins two 2D lists with a hash join. See hash_join_rows.
+    :param p_table: Primary table. A 2D list or a CSV_Table.Table
+    :param f_table: Foreign table. A 2D list or a CSV_Table.Table
+    :param p_keys: Primary key column name, or a list of names for a composite key
+    :param f_keys: Foreign key column name, or a list of names in the same order as p_keys
+    :param how: "left", "inner" or "anti"
+    :param insert_w_pkey: False = append / True = insert after the (first) primary key column
+    :return: joined table as a 2D list
+    """
+    return list(hash_join_rows(p_table, f_table, p_keys, f_keys, how, insert_w_pkey))
+
+
 def left_join(p_table, f_table, p_key, f_key, insert_w_pkey=False):
     """
     Performs a left join between two 2D lists
-    :param p_table: Primary table
-    :param f_table: Foreign table
+    :param p_table: Primary table. A 2D list or a CSV_Table.Table
+    :param f_table: Foreign table. A 2D list or a CSV_Table.Table
     :param p_key: Primary Key
     :param f_key: Foreign Key
     :param insert_w_pkey: False = append / True = insert without p_key
     :return: joined table as a 2D list
     """
-    p_key_col = indexer(p_table[0], [p_key])[0]
-    f_key_col = indexer(f_table[0], [f_key])[0]
-
-    # holds joined table
-    joined_table = []
-
-    # joins headers
-    joined_headers = p_table[0]
-    field_count = 1
-    for header in f_table[0]:
-        # removes the fKey col header from appearing in final join
-        if header != f_table[0][f_key_col]:
-            if insert_w_pkey is False:
-                joined_headers.append(header)
-            if insert_w_pkey is True:
-                joined_headers.insert(p_key_col + field_count, header)
-            field_count += 1
-
-    joined_table.append(joined_headers)
-    # print(joinedHeaders)
-
-    # only keeps first occurrence of f_key
-    f_keys = []
-    f_table_2 = []
-
-    for row in f_table:
-        if str(row[f_key_col]) not in f_keys:
-            f_keys.append(str(row[f_key_col]))
-            f_table_2.append(row)
-
-    for pRow in p_table[1:]:
-        key = str(pRow[p_key_col])
-        joined_row = pRow
-
-        for fRow in f_table_2[1:]:
-            if str(fRow[f_key_col]) == key:
-                cell_count = 0
-                for cell in fRow:
-                    # removes the fKey col from appearing in final join
-                    if cell != fRow[f_key_col]:
-                        if insert_w_pkey is False:
-                            joined_row.append(cell)
-                        if insert_w_pkey is True:
-                            joined_row.insert(p_key_col + cell_count, cell)
-                    cell_count += 1
-
-        if key not in f_keys:
-            if insert_w_pkey is False:
-                joined_row.append("")
-            if insert_w_pkey is True:
-                joined_row.insert(p_key_col + 1, "")
-
-        joined_table.append(joined_row)
+    return hash_join(p_table, f_table, p_key, f_key, "left", insert_w_pkey)
+
+
+def spatial_join(p_table, f_table, p_coord_cols, f_coord_cols, max_dist=None, nearest=True,
+                 dist_col_name="Distance (m)"):
+    """
+    Performs a left join between two 2D lists that matches rows by distance instead of by key.
+    Headers are merged like left_join, with a distance column added at the end.
+    The foreign table is put into a Spatial_Index.GridIndex, so rows are not compared pair by pair.
+    :param p_table: Primary table
+    :param f_table: Foreign table
+    :param p_coord_cols: Primary x, y col names : [x_col_name, y_col_name]
+    :param f_coord_cols: Foreign x, y col names : [x_col_name, y_col_name]
+    :param max_dist: Largest distance in meters to match. Required when nearest is False.
+    :param nearest: True = attach the nearest foreign row / False = one output row for every foreign row
+                    within max_dist
+    :param dist_col_name: Name of the distance column
+    :return: joined table as a 2D list. Primary rows without a match are padded with "".
+    """
+    if not nearest and max_dist is None:
+        raise ValueError("max_dist is required when nearest is False")
+
+    p_x_col, p_y_col = indexer(p_table[0], p_coord_cols[:2])
+    f_index = Spatial_Index.GridIndex.from_csv_list(f_table, f_coord_cols[0], f_coord_cols[1])
+
+    joined_table = [list(p_table[0]) + list(f_table[0]) + [dist_col_name]]
+    no_match = [""] * (len(f_table[0]) + 1)
+
+    for p_row in p_table[1:]:
+        try:
+            x = float(p_row[p_x_col])
+            y = float(p_row[p_y_col])
+        except (ValueError, IndexError):
+            matches = []
+        else:
+            if not (isfinite(x) and isfinite(y)):
+                matches = []
+            elif nearest:
+                matches = f_index.nearest(x, y, 1, max_dist)
+            else:
+                matches = f_index.radius(x, y, max_dist)
+
+        if not matches:
+            joined_table.append(list(p_row) + no_match)
+        for f_row_index, dist in matches:
+            joined_table.append(list(p_row) + list(f_table[f_row_index]) + [dist])
+
+    return joined_table
+
+
+# polygons and their index, set in each worker process by _polygon_pool_setup
+_pool_polygons = None
+
+
+def _polygon_pool_setup(rings, index):
+    """
+    Stores the polygons in a worker process so they are only sent once
+    :param rings: List of (array of x, array of y)
+    :param index: Spatial_Index.BBoxIndex of rings
+    :return: Sets _pool_polygons
+    """
+    global _pool_polygons
+    _pool_polygons = (rings, index)
+
+
+def _polygon_matches(points, rings=None, index=None):
+    """
+    Finds the first polygon that contains each point
+    :param points: List of (x, y), or None for rows without coordinates
+    :param rings: List of (array of x, array of y). Taken from _pool_polygons if None.
+    :param index: Spatial_Index.BBoxIndex of rings
+    :return: List of polygon positions, -1 where no polygon contains the point
+    """
+    if rings is None:
+        rings, index = _pool_polygons
+
+    matches = []
+    for point in points:
+        match = -1
+        if point is not None:
+            for poly_id in index.point(point[0], point[1]):
+                if GIS_Basics.point_in_polygon(point[0], point[1], rings[poly_id][0], rings[poly_id][1]):
+                    match = poly_id
+                    break
+        matches.append(match)
+    return matches
+
+
+def polygon_join(csv_list, coord_col_names, poly_coords, attributes, processes=1, chunk_size=10000):
+    """
+    Tags each point row with the attributes of the polygon that contains it.
+    Takes the same poly_coords and attributes as KML_Build.solid_polygon.
+    Polygon bounds are indexed with Spatial_Index.BBoxIndex and ray casting only runs on polygons whose
+    bounds contain the point. When polygons overlap, the first one wins.
+    :param csv_list: csv that has been converted to a 2D list.
+    :param coord_col_names: x, y col names : [x_col_name, y_col_name]
+    :param poly_coords: [[[x y, z], [x y, z], [x y, z]], [poly 2], [poly 3]
+    :param attributes: [[Header], [Poly 1 Attributes], [Poly 2 Attributes]]
+    :param processes: Number of worker processes. 1 = no process pool, None = all cores
+    :param chunk_size: Number of rows sent to a worker at a time
+    :return: joined table as a 2D list. Rows outside every polygon are padded with "".
+    """
+    x_col, y_col = indexer(csv_list[0], coord_col_names[:2])
+    rings = [GIS_Basics.ring_arrays(poly) for poly in poly_coords]
+    index = Spatial_Index.BBoxIndex.from_rings(rings)
+
+    points = []
+    for row in csv_list[1:]:
+        try:
+            x = float(row[x_col])
+            y = float(row[y_col])
+        except (ValueError, IndexError):
+            points.append(None)
+            continue
+        # nan and inf parse as floats but cannot be put in a grid cell
+        points.append((x, y) if isfinite(x) and isfinite(y) else None)
+
+    if processes == 1:
+        matches = _polygon_matches(points, rings, index)
+    else:
+        points_iter = iter(points)
+        chunks = iter(lambda: list(islice(points_iter, chunk_size)), [])
+        matches = []
+        with Pool(processes, _polygon_pool_setup, (rings, index)) as pool:
+            for _, chunk_matches in bounded_imap(lambda chunk: pool.apply_async(_polygon_matches, (chunk,)).get,
+                                                 chunks, _pool_window(processes)):
+                matches.extend(chunk_matches)
+
+    joined_table = [list(csv_list[0]) + list(attributes[0])]
+    no_match = [""] * len(attributes[0])
+    for row, match in zip(csv_list[1:], matches):
+        joined_table.append(list(row) + (no_match if match == -1 else list(attributes[match + 1])))
+
     return joined_table
+
+
+def _radius_group(seeds, x, y, tolerance, new_group_id):
+    """
+    Finds the group a point belongs to for thin_points in radius mode, or starts a new group
+    :param seeds: Dict of grid cell to [(x, y, group id)] of the first point of each group
+    :param x: longitude
+    :param y: latitude
+    :param tolerance: group radius in meters
+    :param new_group_id: id to give the point's group if it is not near an existing one
+    :return: group id
+    """
+    nearest = None
+    for cell in GIS_Basics.grid_neighbours(x, y, tolerance):
+        for seed_x, seed_y, group_id in seeds.get(cell, ()):
+            dist = GIS_Basics.coord_dist([x, y, seed_x, seed_y])
+            if dist <= tolerance and (nearest is None or dist < nearest[0]):
+                nearest = (dist, group_id)
+
+    if nearest is not None:
+        return nearest[1]
+
+    seeds.setdefault(GIS_Basics.grid_cell(x, y, tolerance), []).append((x, y, new_group_id))
+    return new_group_id
+
+
+def thin_points(rows, coord_col_names, tolerance, strategy="first", mode="cell", value_col_name=None):
+    """
+    Keeps one row for each group of nearby points, such as repeated fixes from a sensor.
+    Points are hashed into GIS_Basics.grid_cell cells, so rows are never compared pair by pair.
+    Yields a header-first table that can be passed to KML_Build.placemarks or KMLWriter.write_placemarks.
+    "first" yields rows as they are read. The other strategies hold one row per group and yield them at the end.
+    :param rows: Iterable of rows, such as a csv.reader or 2D list. The first row must be the header row.
+    :param coord_col_names: x, y col names : [x_col_name, y_col_name]
+    :param tolerance: meters. Cell width in "cell" mode, group radius in "radius" mode.
+    :param strategy: Row kept for each group. "first", "last", "mean" = the first row moved to the mean position,
+                     "max" = the row with the highest number in value_col_name
+    :param mode: "cell" = one row per grid cell
+                 "radius" = a point joins the nearest group whose first point is within tolerance,
+                 otherwise it starts a new group
+    :param value_col_name: Column compared by the "max" strategy
+    :return: generator of rows, header first. Rows whose coordinates are not numbers are dropped.
+    """
+    if strategy not in ("first", "last", "mean", "max"):
+        raise ValueError("Unknown strategy: " + str(strategy))
+    if mode not in ("cell", "radius"):
+        raise ValueError("Unknown mode: " + str(mode))
+
+    rows = iter(rows)
+    headers = next(rows)
+    x_col, y_col = indexer(headers, coord_col_names[:2])
+    value_col = headers.index(value_col_name) if strategy == "max" else None
+    yield headers
+
+    seeds = {}
+    # group key: [row, point count, sum of x, sum of y, highest value]
+    groups = {}
+    for row in rows:
+        try:
+            x = float(row[x_col])
+            y = float(row[y_col])
+        except (ValueError, IndexError):
+            continue
+        if not (isfinite(x) and isfinite(y)):
+            continue
+
+        if mode == "cell":
+            key = GIS_Basics.grid_cell(x, y, tolerance)
+        else:
+            key = _radius_group(seeds, x, y, tolerance, len(groups))
+
+        if strategy == "first":
+            if key not in groups:
+                groups[key] = None
+                yield row
+            continue
+
+        group = groups.get(key)
+        if group is None:
+            value = None
+            if strategy == "max":
+                try:
+                    value = float(row[value_col])
+                except (ValueError, IndexError):
+                    value = float("-inf")
+            groups[key] = [row, 1, x, y, value]
+        elif strategy == "last":
+            group[0] = row
+        elif strategy == "mean":
+            group[1] += 1
+            group[2] += x
+            group[3] += y
+        elif strategy == "max":
+            try:
+                value = float(row[value_col])
+            except (ValueError, IndexError):
+                continue
+            if value > group[4]:
+                group[0] = row
+                group[4] = value
+
+    if strategy == "first":
+        return
+
+    for row, count, sum_x, sum_y, value in groups.values():
+        if strategy == "mean" and count > 1:
+            row = list(row)
+            row[x_col] = str(sum_x / count)
+            row[y_col] = str(sum_y / count)
+        yield row
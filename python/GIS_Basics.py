@@ -1,17 +1,23 @@
-from math import sin, cos, sqrt, atan2, radians
+import heapq
+from array import array
+from math import sin, cos, sqrt, atan2, radians, degrees, floor, isfinite
 
+# optional: only the batch distance functions use NumPy. See requirements.txt.
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-def coord_dist(coord_set):
+
+def _haversine(x1, y1, x2, y2):
     """
-    calculates distance between coordinate pairs in meters
-    :param coord_set: [x1, y1, x2, y2]
-    :return:
+    Great circle distance in meters between two coordinates, not rounded
+    :param x1: longitude of first coordinate, as a float
+    :param y1: latitude of first coordinate, as a float
+    :param x2: longitude of second coordinate, as a float
+    :param y2: latitude of second coordinate, as a float
+    :return: distance in meters
     """
-    x1 = float(coord_set[0])
-    y1 = float(coord_set[1])
-    x2 = float(coord_set[2])
-    y2 = float(coord_set[3])
-
     # approximate radius of Earth in meters
     r = 6373000.0
 
@@ -26,14 +32,29 @@ def coord_dist(coord_set):
     a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
     c = 2 * atan2(sqrt(a), sqrt(1 - a))
 
-    distance = r * c
+    return r * c
+
+
+def coord_dist(coord_set):
+    """
+    calculates distance between coordinate pairs in meters
+    :param coord_set: [x1, y1, x2, y2]
+    :return:
+    """
+    x1 = float(coord_set[0])
+    y1 = float(coord_set[1])
+    x2 = float(coord_set[2])
+    y2 = float(coord_set[3])
+
+    distance = _haversine(x1, y1, x2, y2)
     return round(distance)
 
 
-def coord_dist_3d(coord_set):
+def coord_dist_3d(coord_set, rounded=True):
     """
     calculates distance between coordinate pairs in meters
     :param coord_set: [x1, y1, z1, x2, y2, z2]
+    :param rounded: False = return the distance unrounded, for adding up many short segments (Optional)
     :return:
     """
     x1 = float(coord_set[0])
@@ -44,25 +65,414 @@ def coord_dist_3d(coord_set):
     y2 = float(coord_set[4])
     z2 = float(coord_set[5])
 
+    distance = _haversine(x1, y1, x2, y2)
+
+    h = abs(z1 - z2)
+
+    distance_3d = distance**2 + h**2
+    distance_3d = sqrt(distance_3d)
+
+    if not rounded:
+        return distance_3d
+    return round(distance_3d)
+
+
+def grid_cell(x, y, cell_size):
+    """
+    Finds the grid cell a coordinate falls in. Cells are roughly cell_size meters on each side.
+    Cell heights are fixed in degrees of latitude. Cell widths are set for the latitude of each row of cells.
+    :param x: longitude
+    :param y: latitude
+    :param cell_size: cell width in meters
+    :return: (column, row) of cell
+    """
     # approximate radius of Earth in meters
     r = 6373000.0
 
-    lat1 = radians(y1)
-    lon1 = radians(x1)
-    lat2 = radians(y2)
-    lon2 = radians(x2)
+    lat_size = degrees(cell_size / r)
+    row = floor(y / lat_size)
+    lon_size = lat_size / max(cos(radians((row + 0.5) * lat_size)), 1e-6)
 
-    dlon = lon2 - lon1
+    return floor(x / lon_size), row
+
+
+def grid_neighbours(x, y, cell_size):
+    """
+    Finds the grid cells that can hold a coordinate within cell_size meters of a point.
+    Cell widths change from row to row, so the column is looked up again in each neighbouring row and
+    two columns either side are included.
+    :param x: longitude
+    :param y: latitude
+    :param cell_size: cell width in meters, as passed to grid_cell
+    :return: list of (column, row) of cells
+    """
+    # approximate radius of Earth in meters
+    r = 6373000.0
+
+    lat_size = degrees(cell_size / r)
+    cells = []
+    for row_offset in (-1, 0, 1):
+        near_col, near_row = grid_cell(x, y + row_offset * lat_size, cell_size)
+        cells.extend((col, near_row) for col in range(near_col - 2, near_col + 3))
+    return cells
+
+
+def grid_cell_bounds(cell, cell_size):
+    """
+    Finds the bounds of a grid cell created by grid_cell
+    :param cell: (column, row) of cell
+    :param cell_size: cell width in meters
+    :return: [west, south, east, north]
+    """
+    # approximate radius of Earth in meters
+    r = 6373000.0
+
+    col, row = cell
+    lat_size = degrees(cell_size / r)
+    lon_size = lat_size / max(cos(radians((row + 0.5) * lat_size)), 1e-6)
+
+    return [col * lon_size, row * lat_size, (col + 1) * lon_size, (row + 1) * lat_size]
+
+
+def _valid_coords(coords):
+    """
+    Drops coordinates whose x or y is not a finite number
+    :param coords: [[x, y, z], [x, y, z]]
+    :return: valid coordinates, array of x, array of y
+    """
+    if hasattr(coords, "xs"):
+        # Geometry.Ring, already parsed
+        return list(coords), array("d", coords.xs), array("d", coords.ys)
+
+    valid = []
+    xs = array("d")
+    ys = array("d")
+    for coord_set in coords:
+        try:
+            x = float(coord_set[0])
+            y = float(coord_set[1])
+        except (ValueError, IndexError):
+            continue
+        if not (isfinite(x) and isfinite(y)):
+            continue
+        valid.append(coord_set)
+        xs.append(x)
+        ys.append(y)
+    return valid, xs, ys
+
+
+def _local_meters(xs, ys):
+    """
+    Projects coordinates to meters on a plane centred on the first coordinate, using the same Earth radius as
+    coord_dist. Accurate for the short distances that simplification compares.
+    :param xs: array of x
+    :param ys: array of y
+    :return: array of x in meters, array of y in meters
+    """
+    # approximate radius of Earth in meters
+    r = 6373000.0
+
+    lon0 = xs[0]
+    lat0 = ys[0]
+    x_scale = radians(1) * r * cos(radians(lat0))
+    y_scale = radians(1) * r
+
+    return array("d", [(x - lon0) * x_scale for x in xs]), array("d", [(y - lat0) * y_scale for y in ys])
+
+
+def _douglas_peucker(xs, ys, tolerance):
+    """
+    Marks the points Douglas-Peucker keeps. Uses a stack instead of recursion.
+    :return: bytearray where 1 = keep
+    """
+    keep = bytearray(len(xs))
+    keep[0] = 1
+    keep[-1] = 1
+    stack = [(0, len(xs) - 1)]
+    tolerance_sq = tolerance * tolerance
+
+    while stack:
+        first, last = stack.pop()
+        x1 = xs[first]
+        y1 = ys[first]
+        dx = xs[last] - x1
+        dy = ys[last] - y1
+        length_sq = dx * dx + dy * dy
+
+        farthest = -1
+        farthest_sq = tolerance_sq
+        for i in range(first + 1, last):
+            px = xs[i] - x1
+            py = ys[i] - y1
+            if length_sq == 0:
+                dist_sq = px * px + py * py
+            else:
+                t = min(max((px * dx + py * dy) / length_sq, 0.0), 1.0)
+                ex = px - t * dx
+                ey = py - t * dy
+                dist_sq = ex * ex + ey * ey
+            if dist_sq > farthest_sq:
+                farthest = i
+                farthest_sq = dist_sq
+
+        if farthest != -1:
+            keep[farthest] = 1
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+
+    return keep
+
+
+def _visvalingam(xs, ys, tolerance):
+    """
+    Marks the points Visvalingam-Whyatt keeps. Points are removed smallest triangle first using a heap.
+    :return: bytearray where 1 = keep
+    """
+    count = len(xs)
+    keep = bytearray([1]) * count
+    prev = list(range(-1, count - 1))
+    nxt = list(range(1, count + 1))
+    min_area = tolerance * tolerance
+
+    def area(i):
+        a = prev[i]
+        c = nxt[i]
+        return abs((xs[a] - xs[c]) * (ys[i] - ys[a]) - (xs[a] - xs[i]) * (ys[c] - ys[a])) / 2
+
+    areas = [0.0] * count
+    heap = []
+    for i in range(1, count - 1):
+        areas[i] = area(i)
+        heap.append((areas[i], i))
+    heapq.heapify(heap)
+
+    while heap:
+        point_area, i = heapq.heappop(heap)
+        if not keep[i] or point_area != areas[i]:
+            # removed, or superseded by a newer area
+            continue
+        if point_area >= min_area:
+            break
+        keep[i] = 0
+        a = prev[i]
+        c = nxt[i]
+        nxt[a] = c
+        prev[c] = a
+        for neighbour in (a, c):
+            if 0 < neighbour < count - 1:
+                # an area never shrinks below the point just removed, so the order of removal is kept
+                areas[neighbour] = max(area(neighbour), point_area)
+                heapq.heappush(heap, (areas[neighbour], neighbour))
+
+    return keep
+
+
+def simplify_line(coords, tolerance, method="vw"):
+    """
+    Removes vertices from a line that change its shape by less than tolerance meters.
+    Coordinates that are not numbers are dropped.
+    :param coords: [[x, y, z], [x, y, z]]
+    :param tolerance: meters
+    :param method: "vw" = Visvalingam-Whyatt (triangle area below tolerance squared). O(n log n).
+                   "dp" = Douglas-Peucker (largest offset below tolerance). O(n log n) on typical lines but
+                   O(n^2) when each split only removes one vertex, such as a long zigzag.
+    :return: list of the coordinates that are kept
+    """
+    coords, xs, ys = _valid_coords(coords)
+    if len(coords) < 3 or tolerance <= 0:
+        return coords
+
+    xs, ys = _local_meters(xs, ys)
+    if method == "dp":
+        keep = _douglas_peucker(xs, ys, tolerance)
+    elif method == "vw":
+        keep = _visvalingam(xs, ys, tolerance)
+    else:
+        raise ValueError("method must be 'dp' or 'vw'")
+
+    return [coords[i] for i in range(len(coords)) if keep[i]]
+
+
+def simplify_ring(coords, tolerance, method="vw"):
+    """
+    Simplifies a polygon ring, such as a polygon in KML_Build.solid_polygon's poly_coords.
+    The ring is split at the vertex farthest from its first vertex so both halves keep their ends.
+    :param coords: [[x, y, z], [x, y, z]]. The ring may be open or closed.
+    :param tolerance: meters
+    :param method: "vw" or "dp". See simplify_line.
+    :return: list of the coordinates that are kept, open or closed like the input. At least 3 are kept.
+    """
+    coords, xs, ys = _valid_coords(coords)
+    closed = len(coords) > 1 and xs[0] == xs[-1] and ys[0] == ys[-1]
+    if closed:
+        coords = coords[:-1]
+        xs = xs[:-1]
+        ys = ys[:-1]
+    if len(coords) < 4 or tolerance <= 0:
+        return coords + coords[:1] if closed else coords
+
+    mx, my = _local_meters(xs, ys)
+    farthest = max(range(len(coords)), key=lambda i: mx[i] * mx[i] + my[i] * my[i])
+
+    first_half = simplify_line(coords[:farthest + 1], tolerance, method)
+    second_half = simplify_line(coords[farthest:] + coords[:1], tolerance, method)
+    simplified = first_half + second_half[1:-1]
+
+    if len(simplified) < 3:
+        simplified = coords
+    return simplified + simplified[:1] if closed else simplified
+
+
+def lod_tolerance(bounds, lod_pixels):
+    """
+    Picks a simplification tolerance for a Region: the ground size of one screen pixel when the
+    Region's bounds are lod_pixels wide. Vertices closer than this cannot be seen at that level.
+    :param bounds: [west, south, east, north]
+    :param lod_pixels: minLodPixels of the Region
+    :return: tolerance in meters
+    """
+    west, south, east, north = bounds
+    mid_y = (south + north) / 2
+    width = max(coord_dist([west, mid_y, east, mid_y]), coord_dist([west, south, west, north]))
+    return width / max(lod_pixels, 1)
+
+
+def _float_column(values):
+    """
+    Converts a column of numbers or numeric strings to floats
+    :param values: list, array('d') or NumPy array
+    :return: NumPy float array, or array('d') or a list of floats when NumPy is not installed
+    """
+    if np is not None:
+        return np.asarray(values, dtype=float)
+    if isinstance(values, array) and values.typecode == "d":
+        return values
+    return list(map(float, values))
+
+
+def _haversine_batch(x1, y1, x2, y2):
+    """
+    Great circle distances in meters between pairs of coordinate columns, not rounded
+    :return: NumPy float array, or array('d') when NumPy is not installed
+    """
+    if np is None:
+        # runs _haversine per pair, so it is about as fast as calling coord_dist on each row
+        return array("d", map(_haversine, x1, y1, x2, y2))
+
+    # approximate radius of Earth in meters
+    r = 6373000.0
+
+    lat1 = np.radians(y1)
+    lat2 = np.radians(y2)
+    dlon = np.radians(x2) - np.radians(x1)
     dlat = lat2 - lat1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return r * (2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a)))
 
-    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
 
-    distance = r * c
+def _rounded(distances):
+    """
+    Rounds distances to whole meters the same way coord_dist does
+    :return: NumPy int64 array, or array('q') when NumPy is not installed
+    """
+    if np is not None:
+        return np.rint(distances).astype(np.int64)
+    return array("q", map(round, distances))
+
 
-    h = abs(z1 - z2)
+def coord_dist_batch(x1, y1, x2, y2):
+    """
+    calculates distances between columns of coordinate pairs in meters. Matches coord_dist row by row.
+    Columns can be lists of numbers or numeric strings, array('d') or NumPy arrays.
+    NumPy is needed for the speedup (see requirements.txt). Without it this runs coord_dist's formula on each row.
+    :param x1: column of x1
+    :param y1: column of y1
+    :param x2: column of x2
+    :param y2: column of y2
+    :return: array of distances
+    """
+    return _rounded(_haversine_batch(_float_column(x1), _float_column(y1), _float_column(x2), _float_column(y2)))
 
-    distance_3d = distance**2 + h**2
-    distance_3d = sqrt(distance_3d)
 
-    return round(distance_3d)
+def coord_dist_3d_batch(x1, y1, z1, x2, y2, z2):
+    """
+    calculates distances between columns of 3D coordinate pairs in meters. Matches coord_dist_3d row by row.
+    :param x1: column of x1
+    :param y1: column of y1
+    :param z1: column of z1
+    :param x2: column of x2
+    :param y2: column of y2
+    :param z2: column of z2
+    :return: array of distances
+    """
+    distances = _haversine_batch(_float_column(x1), _float_column(y1), _float_column(x2), _float_column(y2))
+    z1 = _float_column(z1)
+    z2 = _float_column(z2)
+
+    if np is not None:
+        return _rounded(np.sqrt(distances ** 2 + np.abs(z1 - z2) ** 2))
+    return _rounded([sqrt(distance ** 2 + abs(z_1 - z_2) ** 2) for distance, z_1, z_2 in zip(distances, z1, z2)])
+
+
+def track_dist(xs, ys, zs=None):
+    """
+    calculates the distance between each point and the next point in a track, in meters
+    :param xs: column of x
+    :param ys: column of y
+    :param zs: column of z. Distances are 3D when given. (Optional)
+    :return: array of distances, one shorter than the track
+    """
+    xs = _float_column(xs)
+    ys = _float_column(ys)
+    if zs is None:
+        return coord_dist_batch(xs[:-1], ys[:-1], xs[1:], ys[1:])
+    zs = _float_column(zs)
+    return coord_dist_3d_batch(xs[:-1], ys[:-1], zs[:-1], xs[1:], ys[1:], zs[1:])
+
+
+def one_to_many_dist(x, y, xs, ys):
+    """
+    calculates the distance from one point to each point in a column, in meters
+    :param x: x of the single point
+    :param y: y of the single point
+    :param xs: column of x
+    :param ys: column of y
+    :return: array of distances
+    """
+    xs = _float_column(xs)
+    ys = _float_column(ys)
+    x1 = _float_column([float(x)] * len(xs))
+    y1 = _float_column([float(y)] * len(xs))
+    return coord_dist_batch(x1, y1, xs, ys)
+
+
+def ring_arrays(coords):
+    """
+    Converts a polygon ring to coordinate arrays. Coordinates that are not numbers are dropped.
+    :param coords: [[x, y, z], [x, y, z]] or a Geometry.Ring
+    :return: array of x, array of y
+    """
+    return _valid_coords(coords)[1:]
+
+
+def point_in_polygon(x, y, ring_xs, ring_ys):
+    """
+    Tests whether a point is inside a polygon ring by ray casting. Points exactly on an edge may land either side.
+    :param x: longitude of point
+    :param y: latitude of point
+    :param ring_xs: x of each ring vertex. The ring may be open or closed.
+    :param ring_ys: y of each ring vertex
+    :return: True if the point is inside
+    """
+    inside = False
+    count = len(ring_xs)
+    j = count - 1
+    for i in range(count):
+        yi = ring_ys[i]
+        yj = ring_ys[j]
+        if (yi > y) != (yj > y):
+            xi = ring_xs[i]
+            if x < (ring_xs[j] - xi) * (y - yi) / (yj - yi) + xi:
+                inside = not inside
+        j = i
+    return inside
@@ -0,0 +1,284 @@
+from array import array
+
+
+def _xyz(coord_set):
+    """
+    Parses one coordinate. z defaults to 0 when the coordinate has no z.
+    :param coord_set: [x, y, z] or [x, y]
+    :return: (x, y, z) as floats
+    """
+    x = float(coord_set[0])
+    y = float(coord_set[1])
+    z = float(coord_set[2]) if len(coord_set) > 2 else 0.0
+    return x, y, z
+
+
+class Point:
+    """
+    View of one coordinate held in a Points, Lines or Rings container. Indexes like [x, y, z].
+    """
+    __slots__ = ("coords", "position")
+
+    def __init__(self, coords, position):
+        self.coords = coords
+        self.position = position
+
+    @property
+    def x(self):
+        return self.coords.xs[self.position]
+
+    @property
+    def y(self):
+        return self.coords.ys[self.position]
+
+    @property
+    def z(self):
+        return self.coords.zs[self.position]
+
+    def __len__(self):
+        return 3
+
+    def __getitem__(self, index):
+        return (self.coords.xs, self.coords.ys, self.coords.zs)[index][self.position]
+
+    def __iter__(self):
+        yield self.coords.xs[self.position]
+        yield self.coords.ys[self.position]
+        yield self.coords.zs[self.position]
+
+    def __repr__(self):
+        return "Point(" + str(self.x) + ", " + str(self.y) + ", " + str(self.z) + ")"
+
+
+class Points:
+    """
+    Coordinates stored in three array('d') columns, parsed once from a CSV list.
+    The columns can be passed straight to the GIS_Basics batch distance functions and Spatial_Index.GridIndex.
+    rows holds the row index of each point in the CSV list the points were built from (the header is row 0).
+    """
+
+    def __init__(self, xs=(), ys=(), zs=None, rows=None):
+        """
+        Builds a container from coordinate columns
+        :param xs: x coordinates (longitude)
+        :param ys: y coordinates (latitude)
+        :param zs: z coordinates. Defaults to 0.
+        :param rows: CSV row index of each point. Defaults to 1, 2, 3...
+        """
+        self.xs = array("d", xs)
+        self.ys = array("d", ys)
+        self.zs = array("d", zs) if zs is not None else array("d", bytes(8 * len(self.xs)))
+        self.rows = array("q", rows if rows is not None else range(1, len(self.xs) + 1))
+
+    def __len__(self):
+        return len(self.xs)
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self.xs)
+        if not 0 <= position < len(self.xs):
+            raise IndexError("point index out of range")
+        return Point(self, position)
+
+    def __iter__(self):
+        for position in range(len(self.xs)):
+            yield Point(self, position)
+
+    @classmethod
+    def from_csv_list(cls, csv_list, coord_col_names):
+        """
+        Parses the coordinate columns of a 2D list. Rows whose coordinates are not numbers are skipped.
+        :param csv_list: csv that has been converted to a 2D list.
+        :param coord_col_names: List of x, y, z cols names : [x_col_name, y_col_name, z_col_name]. z is optional.
+        :return: Points
+        """
+        col_indexes = [csv_list[0].index(col) for col in coord_col_names[:3]]
+
+        points = cls()
+        for row_index in range(1, len(csv_list)):
+            row = csv_list[row_index]
+            try:
+                x, y, z = _xyz([row[col_index] for col_index in col_indexes])
+            except (ValueError, IndexError):
+                continue
+            points.xs.append(x)
+            points.ys.append(y)
+            points.zs.append(z)
+            points.rows.append(row_index)
+
+        return points
+
+    def row_coords(self, rows):
+        """
+        Pairs rows with their parsed coordinates. Rows without a point are dropped.
+        :param rows: Rows of the CSV list the points were built from, without the header row.
+        :return: generator of (row, Point)
+        """
+        position = 0
+        count = len(self.xs)
+        point_rows = self.rows
+        for row_index, row in enumerate(rows, 1):
+            if position < count and point_rows[position] == row_index:
+                yield row, Point(self, position)
+                position += 1
+
+
+class Lines:
+    """
+    Two point lines stored as a Points of start coordinates and a Points of end coordinates.
+    """
+
+    def __init__(self, starts, ends):
+        """
+        :param starts: Points of line starts
+        :param ends: Points of line ends, with the same rows as starts
+        """
+        self.starts = starts
+        self.ends = ends
+        self.rows = starts.rows
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, position):
+        return self.starts[position], self.ends[position]
+
+    def __iter__(self):
+        for position in range(len(self.starts)):
+            yield Point(self.starts, position), Point(self.ends, position)
+
+    @classmethod
+    def from_csv_list(cls, csv_list, coord_col_names):
+        """
+        Parses the coordinate columns of a 2D list. Rows whose coordinates are not numbers are skipped.
+        :param csv_list: csv that has been converted to a 2D list.
+        :param coord_col_names: A list of col names : [x1_col_name, y1_col_name, z1_col_name, x2_col_name, y2_col_name, z2_col_name]
+        :return: Lines
+        """
+        col_indexes = [csv_list[0].index(col) for col in coord_col_names[:6]]
+
+        starts = Points()
+        ends = Points()
+        for row_index in range(1, len(csv_list)):
+            row = csv_list[row_index]
+            try:
+                x1, y1, z1 = _xyz([row[col_index] for col_index in col_indexes[:3]])
+                x2, y2, z2 = _xyz([row[col_index] for col_index in col_indexes[3:]])
+            except (ValueError, IndexError):
+                continue
+            for points, x, y, z in ((starts, x1, y1, z1), (ends, x2, y2, z2)):
+                points.xs.append(x)
+                points.ys.append(y)
+                points.zs.append(z)
+                points.rows.append(row_index)
+
+        return cls(starts, ends)
+
+    def row_coords(self, rows):
+        """
+        Pairs rows with their parsed coordinates. Rows without a line are dropped.
+        :param rows: Rows of the CSV list the lines were built from, without the header row.
+        :return: generator of (row, (start Point, end Point))
+        """
+        for row, start in self.starts.row_coords(rows):
+            yield row, (start, Point(self.ends, start.position))
+
+
+class Ring:
+    """
+    View of one polygon ring held in a Rings container. Iterates like [[x, y, z], [x, y, z]].
+    """
+    __slots__ = ("rings", "index")
+
+    def __init__(self, rings, index):
+        self.rings = rings
+        self.index = index
+
+    @property
+    def start(self):
+        return self.rings.offsets[self.index]
+
+    @property
+    def end(self):
+        return self.rings.offsets[self.index + 1]
+
+    @property
+    def xs(self):
+        return self.rings.xs[self.start:self.end]
+
+    @property
+    def ys(self):
+        return self.rings.ys[self.start:self.end]
+
+    @property
+    def zs(self):
+        return self.rings.zs[self.start:self.end]
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("ring index out of range")
+        return Point(self.rings, self.start + position)
+
+    def __iter__(self):
+        for position in range(self.start, self.end):
+            yield Point(self.rings, position)
+
+
+class Rings:
+    """
+    Polygon rings stored end to end in three array('d') columns. offsets[i]:offsets[i + 1] is ring i.
+    Can be passed to KML_Build.solid_polygon and CSV_Tools.polygon_join in place of poly_coords.
+    """
+
+    def __init__(self):
+        self.xs = array("d")
+        self.ys = array("d")
+        self.zs = array("d")
+        self.offsets = array("q", [0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ring index out of range")
+        return Ring(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield Ring(self, index)
+
+    def append(self, coords):
+        """
+        Adds a ring. Coordinates whose x, y or z is not a number are dropped.
+        :param coords: [[x y, z], [x y, z], [x y, z]]
+        :return: Adds ring to the end
+        """
+        for coord_set in coords:
+            try:
+                x, y, z = _xyz(coord_set)
+            except (ValueError, IndexError):
+                continue
+            self.xs.append(x)
+            self.ys.append(y)
+            self.zs.append(z)
+        self.offsets.append(len(self.xs))
+
+    @classmethod
+    def from_poly_coords(cls, poly_coords):
+        """
+        Parses polygons in the form solid_polygon takes them
+        :param poly_coords: [[[x y, z], [x y, z], [x y, z]], [poly 2], [poly 3]
+        :return: Rings
+        """
+        rings = cls()
+        for coords in poly_coords:
+            rings.append(coords)
+        return rings
@@ -1,4 +1,16 @@
+import copy
+import io
+import os
+import re
+import zipfile
 import xml.etree.ElementTree as ET
+from itertools import islice
+from math import isfinite
+from multiprocessing import Pool
+
+import CSV_Tools
+import GIS_Basics
+import Geometry
 
 
 def color(hex6_color, opacity):
@@ -105,25 +117,14 @@ def polygon_style(name, poly_hex_color="00d0ff", line_hex_color="ff0050", poly_o
     return style
 
 
-def placemarks(csv_list, folder_name, name_col_name, coord_col_names,
-               altitude_mode="ctg", style_to_use=None, description=None, visibility=1):
+def _folder(folder_name, visibility=1, description=None):
     """
-    Creates a folder of KML placemarks from a 2D list
-    :param csv_list: CSV list that contains necessary fields to create a placemark (x, y, z)
-    :param folder_name: Name of folder that will hold placemarks
-    :param name_col_name: Name of the column that contains placemark names
-    :param coord_col_names: List of x, y, z cols names : [x_col_name, y_col_name, z_col_name]
-    :param altitude_mode: Abbreviated altitude mode (Optional)
-    :param style_to_use: Name of point style to use (Optional)
-    :param description: Description of layer (Optional)
+    Creates an empty KML folder
+    :param folder_name: Name of folder
     :param visibility: 1 = Visible, 0 = Invisible (Optional)
-    :return: A folder of placemarks - an XML element as an object
+    :param description: Description of layer (Optional)
+    :return: A folder - an XML element as an object
     """
-
-    x_col_name = coord_col_names[0]
-    y_col_name = coord_col_names[1]
-    z_col_name = coord_col_names[2]
-
     folder = ET.Element("Folder")
     ET.SubElement(folder, "name").text = str(folder_name)
     ET.SubElement(folder, "visibility").text = str(visibility)
@@ -131,47 +132,451 @@ def placemarks(csv_list, folder_name, name_col_name, coord_col_names,
     if description is not None:
         ET.SubElement(folder, "description").text = str(description)
 
-    headers = [header for header in csv_list[0]]
-    cols_to_index = [name_col_name, x_col_name, y_col_name, z_col_name]
-    col_indexes = [headers.index(col) for col in cols_to_index]
+    return folder
+
+
+def _description(headers, row):
+    """
+    Creates a placemark description that lists every attribute of a row
+    :param headers: List of column names
+    :param row: List of attribute values
+    :return: description wrapped in <![CDATA[]]>
+    """
+    attribute_str = "".join(["<b>" + str(headers[cell]) + "</b>: " + str(row[cell]) + "<br>"
+                             for cell in range(len(headers))])
+    return "<![CDATA[" + attribute_str + "]]>"
+
+
+def _extended_data(placemark, headers, row):
+    """
+    Adds the attributes of a row to a placemark as ExtendedData
+    :param placemark: Placemark - an XML element as an object
+    :param headers: List of column names
+    :param row: List of attribute values
+    :return: ExtendedData - an XML element as an object
+    """
+    extended_data = ET.SubElement(placemark, "ExtendedData")
+
+    for cell in range(len(headers)):
+        data = ET.SubElement(extended_data, "Data", name=str(headers[cell]))
+        ET.SubElement(data, "displayName").text = str(headers[cell])
+        ET.SubElement(data, "value").text = str(row[cell])
+
+    return extended_data
+
+
+def _schema_data(placemark, headers, row, schema_id):
+    """
+    Adds the attributes of a row to a placemark as SchemaData that refers to a shared Schema
+    :param placemark: Placemark - an XML element as an object
+    :param headers: List of column names
+    :param row: List of attribute values
+    :param schema_id: id of the Schema
+    :return: ExtendedData - an XML element as an object
+    """
+    extended_data = ET.SubElement(placemark, "ExtendedData")
+    schema_data = ET.SubElement(extended_data, "SchemaData", schemaUrl="#" + schema_id)
+
+    for cell in range(len(headers)):
+        ET.SubElement(schema_data, "SimpleData", name=str(headers[cell])).text = str(row[cell])
+
+    return extended_data
+
+
+def schema_id(name):
+    """
+    Converts a folder name to a value that can be used as a Schema or Style id
+    :param name: folder name
+    :return: id string
+    """
+    return "schema_" + re.sub(r"\W", "_", str(name))
+
 
-    for row in csv_list[1:]:
+def schema(name, headers):
+    """
+    Creates a Schema that declares each column once, for placemarks written with compact=True
+    :param name: id of the Schema
+    :param headers: List of column names
+    :return: a Schema - an XML element as an object
+    """
+    kml_schema = ET.Element("Schema", name=name, id=name)
+    for header in headers:
+        simple_field = ET.SubElement(kml_schema, "SimpleField", type="string", name=str(header))
+        ET.SubElement(simple_field, "displayName").text = str(header)
+
+    return kml_schema
+
+
+def balloon_style(name, schema_name, headers, base_style=None):
+    """
+    Creates a style whose balloon lists every column of a compact placemark with $[field] substitution.
+    Use with style_to_use to give compact placemarks the same balloon as the default description.
+    :param name: Name of style
+    :param schema_name: id of the Schema the placemarks use
+    :param headers: List of column names
+    :param base_style: A style to copy icon, line and polygon settings from (Optional)
+    :return: an XML element as an object
+    """
+    style = ET.Element("Style", id=name)
+    if base_style is not None:
+        for child in base_style:
+            if child.tag != "BalloonStyle":
+                style.append(copy.deepcopy(child))
+
+    balloon = ET.SubElement(style, "BalloonStyle")
+    fields = ["$[" + schema_name + "/" + str(header) + "]" for header in headers]
+    ET.SubElement(balloon, "text").text = _description(headers, fields)
+
+    return style
+
+
+def compact_styles(folder_name, headers, style_to_use=None, line=False):
+    """
+    Creates the Schema and shared style that a folder of compact placemarks refers to.
+    KML only allows a Schema at Document level, so pass these to kml_build with the other styles,
+    or write them with KMLWriter.write_styles before opening any folder.
+    :param folder_name: Name of the folder that holds the compact placemarks
+    :param headers: List of column names
+    :param style_to_use: Name of style placemarks use. The shared style is only created when None.
+    :param line: True = the shared style includes the default red line style of two_point_line
+    :return: List of XML elements
+    """
+    schema_name = schema_id(folder_name)
+    elements = [schema(schema_name, headers)]
+
+    if style_to_use is None:
+        style = balloon_style(schema_name + "_style", schema_name, headers)
+        if line:
+            styled_line = ET.Element("LineStyle")
+            ET.SubElement(styled_line, "color").text = "ff0000ff"
+            ET.SubElement(styled_line, "width").text = "2"
+            style.insert(0, styled_line)
+        elements.append(style)
+
+    return elements
+
+
+def _attributes(placemark, headers, row, compact_id):
+    """
+    Adds the attributes of a row to a placemark as Data, or as SchemaData when compact_id is set
+    :param placemark: Placemark - an XML element as an object
+    :param headers: List of column names
+    :param row: List of attribute values
+    :param compact_id: id of the Schema (Optional)
+    :return: Adds ExtendedData to placemark
+    """
+    if compact_id is None:
+        _extended_data(placemark, headers, row)
+    else:
+        _schema_data(placemark, headers, row, compact_id)
+
+
+def _point_placemark(row, headers, col_indexes, altitude_mode, style_to_use, visibility, compact_id=None,
+                     coords=None):
+    """
+    Creates a single point placemark from a row
+    :param row: List of attribute values
+    :param headers: List of column names
+    :param col_indexes: Column indexes of [name, x, y, z]
+    :param altitude_mode: Full altitude mode
+    :param style_to_use: Name of point style to use
+    :param visibility: 1 = Visible, 0 = Invisible
+    :param compact_id: Schema id for compact output. None = Data and description.
+    :param coords: Already parsed [x, y, z], such as a Geometry.Point. Read from the row if None.
+    :return: A placemark - an XML element as an object. None if the coordinates are not numbers.
+    """
+    if coords is not None:
+        x, y, z = coords
+        z = int(z)
+    else:
         try:
             x = float(row[col_indexes[1]])
             y = float(row[col_indexes[2]])
             z = int(float(row[col_indexes[3]]))
         except ValueError:
-            continue
+            return None
 
-        attributes = [cell for cell in row]
-        attribute_str = "<![CDATA["
+    placemark = ET.Element("Placemark")
+    ET.SubElement(placemark, "name").text = row[col_indexes[0]]
+    ET.SubElement(placemark, "visibility").text = str(visibility)
+    if compact_id is None:
+        ET.SubElement(placemark, "description").text = _description(headers, row)
+    if style_to_use is not None:
+        ET.SubElement(placemark, "styleUrl").text = style_to_use
+    elif compact_id is not None:
+        ET.SubElement(placemark, "styleUrl").text = "#" + compact_id + "_style"
+    point = ET.SubElement(placemark, "Point")
+    ET.SubElement(point, "coordinates").text = str(x) + "," + str(y) + "," + str(z)
+    ET.SubElement(point, "altitudeMode").text = altitude_mode
 
-        for cell in range(len(headers)):
-            attribute_str += "<b>" + str(headers[cell]) + "</b>: " + str(attributes[cell]) + "<br>"
-        attribute_str += "]]>"
+    _attributes(placemark, headers, row, compact_id)
 
-        placemark = ET.SubElement(folder, "Placemark")
-        ET.SubElement(placemark, "name").text = row[col_indexes[0]]
-        ET.SubElement(placemark, "visibility").text = str(visibility)
-        ET.SubElement(placemark, "description").text = attribute_str
-        if style_to_use is not None:
-            ET.SubElement(placemark, "styleUrl").text = style_to_use
-        point = ET.SubElement(placemark, "Point")
-        ET.SubElement(point, "coordinates").text = str(x) + "," + str(y) + "," + str(z)
-        ET.SubElement(point, "altitudeMode").text = altitude_modes(altitude_mode)
+    return placemark
 
-        extended_data = ET.SubElement(placemark, "ExtendedData")
 
-        for cell in range(len(headers)):
-            data = ET.SubElement(extended_data, "Data", name=str(headers[cell]))
-            ET.SubElement(data, "displayName").text = str(headers[cell])
-            ET.SubElement(data, "value").text = str(row[cell])
+def _line_placemark(row, headers, col_indexes, altitude_mode, style_to_use, visibility, draw_order,
+                    compact_id=None, coords=None):
+    """
+    Creates a single two point line placemark from a row
+    :param row: List of attribute values
+    :param headers: List of column names
+    :param col_indexes: Column indexes of [name, x1, y1, z1, x2, y2, z2]
+    :param altitude_mode: Full altitude mode
+    :param style_to_use: Name of line style to use
+    :param visibility: 1 = Visible, 0 = Invisible
+    :param draw_order: order of rendering (Higher values render first)
+    :param compact_id: Schema id for compact output. None = Data, description and an inline default style.
+    :param coords: Already parsed ([x1, y1, z1], [x2, y2, z2]), such as a pair of Geometry.Point.
+                   Read from the row if None.
+    :return: A placemark - an XML element as an object. None if the coordinates are missing or not numbers.
+    """
+    if coords is not None:
+        x1, y1, z1 = coords[0]
+        x2, y2, z2 = coords[1]
+        z1 = int(z1)
+        z2 = int(z2)
+    else:
+        try:
+            x1 = float(row[col_indexes[1]])
+            y1 = float(row[col_indexes[2]])
+            z1 = int(float(row[col_indexes[3]]))
+            x2 = float(row[col_indexes[4]])
+            y2 = float(row[col_indexes[5]])
+            z2 = int(float(row[col_indexes[6]]))
+        except (ValueError, IndexError):
+            return None
+
+    placemark = ET.Element("Placemark")
+    ET.SubElement(placemark, "name").text = row[col_indexes[0]]
+    ET.SubElement(placemark, "visibility").text = str(visibility)
+    if compact_id is None:
+        ET.SubElement(placemark, "description").text = _description(headers, row)
+    ET.SubElement(placemark, "gx:drawOrder").text = str(draw_order)
+    if style_to_use is not None:
+        ET.SubElement(placemark, "styleUrl").text = style_to_use
+    elif compact_id is not None:
+        ET.SubElement(placemark, "styleUrl").text = "#" + compact_id + "_style"
+    else:
+        style = ET.SubElement(placemark, "Style")
+        styled_line = ET.SubElement(style, "LineStyle")
+        ET.SubElement(styled_line, "color").text = "ff0000ff"
+        ET.SubElement(styled_line, "width").text = "2"
+
+    line = ET.SubElement(placemark, "LineString")
+
+    coord_str1 = str(x1) + "," + str(y1) + "," + str(z1)
+    coord_str2 = str(x2) + "," + str(y2) + "," + str(z2)
+    ET.SubElement(line, "coordinates").text = coord_str1 + " " + coord_str2
+    ET.SubElement(line, "altitudeMode").text = altitude_mode
+
+    _attributes(placemark, headers, row, compact_id)
+
+    return placemark
+
+
+def _polygon_placemark(outer_poly, row, headers, name_col_index, altitude_mode, style_to_use, visibility,
+                       compact_id=None):
+    """
+    Creates a single solid polygon placemark
+    :param outer_poly: [[x y, z], [x y, z], [x y, z]] or a Geometry.Ring
+    :param row: List of attribute values
+    :param headers: List of column names
+    :param name_col_index: Column index of polygon name
+    :param altitude_mode: Full altitude mode
+    :param style_to_use: Name of polygon style to use
+    :param visibility: 1 = Visible, 0 = Invisible
+    :param compact_id: Schema id for compact output. None = Data and description.
+    :return: A placemark - an XML element as an object
+    """
+    outer_boundary_coords = []
+    if isinstance(outer_poly, Geometry.Ring):
+        # already parsed, so the columns are read directly
+        for x, y, z in zip(outer_poly.xs, outer_poly.ys, outer_poly.zs):
+            outer_boundary_coords.append(str(x) + "," + str(y) + "," + str(int(z)))
+    else:
+        for coord_set in outer_poly:
+            try:
+                x = float(coord_set[0])
+                y = float(coord_set[1])
+                z = int(float(coord_set[2]))
+
+                outer_boundary_coords.append(str(x) + "," + str(y) + "," + str(z))
+            except ValueError:
+                pass
+    # closes the ring with the first coordinate
+    outer_boundary_coord_str = " ".join(outer_boundary_coords) + " " + outer_boundary_coords[0]
+
+    placemark = ET.Element("Placemark")
+    ET.SubElement(placemark, "name").text = str(row[name_col_index])
+    ET.SubElement(placemark, "visibility").text = str(visibility)
+    if compact_id is None:
+        ET.SubElement(placemark, "description").text = _description(headers, row)
+    if style_to_use is not None:
+        ET.SubElement(placemark, "styleUrl").text = style_to_use
+    elif compact_id is not None:
+        ET.SubElement(placemark, "styleUrl").text = "#" + compact_id + "_style"
+    polygon = ET.SubElement(placemark, "Polygon")
+
+    outer_boundary = ET.SubElement(polygon, "outerBoundaryIs")
+    outer_linear_ring = ET.SubElement(outer_boundary, "LinearRing")
+    ET.SubElement(outer_linear_ring, "coordinates").text = outer_boundary_coord_str
+
+    ET.SubElement(polygon, "altitudeMode").text = altitude_mode
+
+    _attributes(placemark, headers, row, compact_id)
+
+    return placemark
+
+
+def raw_fragment(fragment):
+    """
+    Creates an element that kml_build and KMLWriter write exactly as given, like a cached placemark
+    :param fragment: serialized KML
+    :return: an XML element as an object
+    """
+    elem = ET.Element(raw_fragment)
+    elem.text = fragment
+    return elem
+
+
+def _point_rows(rows, name_col_name, coord_col_names, altitude_mode, style_to_use, visibility, compact_id=None,
+                cache=None, points=None):
+    """
+    Creates point placemarks one row at a time
+    :param rows: Iterable of rows. The first row must be the header row.
+    :param name_col_name: Name of the column that contains placemark names
+    :param coord_col_names: List of x, y, z cols names : [x_col_name, y_col_name, z_col_name]
+    :param altitude_mode: Abbreviated altitude mode
+    :param style_to_use: Name of point style to use
+    :param visibility: 1 = Visible, 0 = Invisible
+    :param compact_id: Schema id for compact output. The Schema and shared style come from compact_styles.
+    :param cache: KML_Cache.FragmentCache. Unchanged rows are yielded as cached raw fragments. (Optional)
+    :param points: Geometry.Points built from the same rows. Coordinates are taken from it instead of parsed.
+    :return: generator of placemarks - XML elements as objects
+    """
+    rows = iter(rows)
+    headers = [header for header in next(rows)]
+    cols_to_index = [name_col_name] + list(coord_col_names[:3])
+    col_indexes = [headers.index(col) for col in cols_to_index]
+    full_altitude_mode = altitude_modes(altitude_mode)
+
+    row_coords = points.row_coords(rows) if points is not None else ((row, None) for row in rows)
+
+    if cache is None:
+        for row, coords in row_coords:
+            placemark = _point_placemark(row, headers, col_indexes, full_altitude_mode, style_to_use, visibility,
+                                         compact_id, coords)
+            if placemark is not None:
+                yield placemark
+        return
+
+    settings = ("point", tuple(headers), tuple(col_indexes), full_altitude_mode, style_to_use, visibility, compact_id)
+    for row, coords in row_coords:
+        key = cache.key(settings, row)
+        fragment = cache.get(key)
+        if fragment is None:
+            placemark = _point_placemark(row, headers, col_indexes, full_altitude_mode, style_to_use, visibility,
+                                         compact_id, coords)
+            # rows without coordinates are cached as empty fragments so they are skipped next time
+            fragment = "" if placemark is None else element_string(placemark)
+            cache.put(key, fragment)
+        if fragment:
+            yield raw_fragment(fragment)
+    cache.commit()
+
+
+def _line_rows(rows, name_col_name, coord_col_names, altitude_mode, style_to_use, visibility, draw_order,
+               compact_id=None, lines=None):
+    """
+    Creates two point line placemarks one row at a time
+    :param rows: Iterable of rows. The first row must be the header row.
+    :param name_col_name: Name of the column that contains line names
+    :param coord_col_names: A list of col names : [x1_col_name, y1_col_name, z1_col_name, x2_col_name, y2_col_name, z2_col_name]
+    :param altitude_mode: Abbreviated altitude mode
+    :param style_to_use: Name of line style to use
+    :param visibility: 1 = Visible, 0 = Invisible
+    :param draw_order: order of rendering (Higher values render first)
+    :param compact_id: Schema id for compact output. The Schema and shared style come from compact_styles.
+    :param lines: Geometry.Lines built from the same rows. Coordinates are taken from it instead of parsed.
+    :return: generator of placemarks - XML elements as objects
+    """
+    rows = iter(rows)
+    headers = [header for header in next(rows)]
+    cols_to_index = [name_col_name] + list(coord_col_names[:6])
+    col_indexes = [headers.index(col) for col in cols_to_index]
+    full_altitude_mode = altitude_modes(altitude_mode)
+
+    row_coords = lines.row_coords(rows) if lines is not None else ((row, None) for row in rows)
+    for row, coords in row_coords:
+        placemark = _line_placemark(row, headers, col_indexes, full_altitude_mode, style_to_use, visibility,
+                                    draw_order, compact_id, coords)
+        if placemark is not None:
+            yield placemark
+
+
+def _polygon_rows(poly_coords, attributes, name_col_name, altitude_mode, style_to_use, visibility,
+                  compact_id=None, simplify_tolerance=None, simplify_method="vw"):
+    """
+    Creates solid polygon placemarks one polygon at a time
+    :param poly_coords: Iterable of polygons : [[[x y, z], [x y, z], [x y, z]], [poly 2], [poly 3]
+    :param attributes: Iterable of attribute rows. The first row must be the header row.
+    :param name_col_name: Name of the column that contains polygon names
+    :param altitude_mode: Abbreviated altitude mode
+    :param style_to_use: Name of polygon style to use
+    :param visibility: 1 = Visible, 0 = Invisible
+    :param compact_id: Schema id for compact output. The Schema and shared style come from compact_styles.
+    :param simplify_tolerance: meters. Polygons are simplified with GIS_Basics.simplify_ring when set.
+    :param simplify_method: "vw" or "dp"
+    :return: generator of placemarks - XML elements as objects
+    """
+    attributes = iter(attributes)
+    headers = [header for header in next(attributes)]
+    name_col_index = headers.index(name_col_name)
+    full_altitude_mode = altitude_modes(altitude_mode)
+
+    for outer_poly in poly_coords:
+        row = next(attributes)
+        if simplify_tolerance:
+            outer_poly = GIS_Basics.simplify_ring(outer_poly, simplify_tolerance, simplify_method)
+        yield _polygon_placemark(outer_poly, row, headers, name_col_index, full_altitude_mode, style_to_use,
+                                 visibility, compact_id)
+
+
+def placemarks(csv_list, folder_name, name_col_name, coord_col_names,
+               altitude_mode="ctg", style_to_use=None, description=None, visibility=1, compact=False, cache=None,
+               points=None):
+    """
+    Creates a folder of KML placemarks from a 2D list
+    :param csv_list: CSV list that contains necessary fields to create a placemark (x, y, z)
+    :param folder_name: Name of folder that will hold placemarks
+    :param name_col_name: Name of the column that contains placemark names
+    :param coord_col_names: List of x, y, z cols names : [x_col_name, y_col_name, z_col_name]
+    :param altitude_mode: Abbreviated altitude mode (Optional)
+    :param style_to_use: Name of point style to use (Optional)
+    :param description: Description of layer (Optional)
+    :param visibility: 1 = Visible, 0 = Invisible (Optional)
+    :param compact: True = declare the columns once in a Schema, write SchemaData instead of Data and
+                    replace each description with a shared BalloonStyle.
+                    Add compact_styles(folder_name, csv_list[0], style_to_use) to the styles of kml_build (Optional)
+    :param cache: KML_Cache.FragmentCache. Rows already in the cache are not rebuilt. The folder can then
+                  only be written with kml_build or KMLWriter. (Optional)
+    :param points: Geometry.Points.from_csv_list(csv_list, coord_col_names). Skips parsing the coordinates
+                   again when the same points are reused. (Optional)
+    :return: A folder of placemarks - an XML element as an object
+    """
+    folder = _folder(folder_name, visibility, description)
+    compact_id = schema_id(folder_name) if compact else None
+
+    # a loop, not extend, so errors raised while building rows are not hidden
+    for placemark in _point_rows(csv_list, name_col_name, coord_col_names, altitude_mode, style_to_use, visibility,
+                                 compact_id, cache, points):
+        folder.append(placemark)
 
     return folder
 
 
 def two_point_line(csv_list, folder_name, name_col_name, coord_col_names, altitude_mode="ctg", style_to_use=None,
-                   description=None, visibility=1, draw_order=0):
+                   description=None, visibility=1, draw_order=0, compact=False, lines=None):
     """
     Creates a folder of KML lines from a 2D list
     :param csv_list: CSV list that contains necessary fields to create a two point line (x, y, z) x2
@@ -183,150 +588,191 @@ def two_point_line(csv_list, folder_name, name_col_name, coord_col_names, altitu
     :param description: Description of layer (Optional)
     :param visibility: 1 = Visible, 0 = Invisible (Optional)
     :param draw_order: order of rendering (Higher values render first)
+    :param compact: True = declare the columns once in a Schema, write SchemaData instead of Data and
+                    replace each description with a shared BalloonStyle.
+                    Lines without style_to_use share one default line style.
+                    Add compact_styles(folder_name, csv_list[0], style_to_use, line=True) to the styles of
+                    kml_build (Optional)
+    :param lines: Geometry.Lines.from_csv_list(csv_list, coord_col_names). Skips parsing the coordinates
+                  again when the same lines are reused. (Optional)
     :return: A folder of lines - an XML element as an object
     """
-    # coord_col_names =
-    x1_col_name = coord_col_names[0]
-    y1_col_name = coord_col_names[1]
-    z1_col_name = coord_col_names[2]
+    folder = _folder(folder_name, visibility, description)
+    compact_id = schema_id(folder_name) if compact else None
 
-    x2_col_name = coord_col_names[3]
-    y2_col_name = coord_col_names[4]
-    z2_col_name = coord_col_names[5]
-
-    folder = ET.Element("Folder")
-    ET.SubElement(folder, "name").text = str(folder_name)
-    ET.SubElement(folder, "visibility").text = str(visibility)
-
-    if description is not None:
-        ET.SubElement(folder, "description").text = str(description)
-
-    headers = [header for header in csv_list[0]]
-    cols_to_index = [name_col_name, x1_col_name, y1_col_name, z1_col_name, x2_col_name, y2_col_name, z2_col_name]
-    col_indexes = [csv_list[0].index(col) for col in cols_to_index]
-    # headers.append("Distance (m)")
-
-    for row in csv_list[1:]:
-        try:
-            x1 = float(row[col_indexes[1]])
-            y1 = float(row[col_indexes[2]])
-            z1 = int(float(row[col_indexes[3]]))
-            x2 = float(row[col_indexes[4]])
-            y2 = float(row[col_indexes[5]])
-            z2 = int(float(row[col_indexes[6]]))
-        except (ValueError, IndexError):
-            continue
-
-        attributes = [cell for cell in row]
-        attribute_str = "<![CDATA["
-        for cell in range(len(headers)):
-            attribute_str += "<b>" + str(headers[cell]) + "</b>: " + str(attributes[cell]) + "<br>"
-        attribute_str += "]]>"
-
-        placemark = ET.SubElement(folder, "Placemark")
-        ET.SubElement(placemark, "name").text = row[col_indexes[0]]
-        ET.SubElement(placemark, "visibility").text = str(visibility)
-        ET.SubElement(placemark, "description").text = attribute_str
-        ET.SubElement(placemark, "gx:drawOrder").text = str(draw_order)
-        if style_to_use is not None:
-            ET.SubElement(placemark, "styleUrl").text = style_to_use
-        else:
-            style = ET.SubElement(placemark, "Style")
-            styled_line = ET.SubElement(style, "LineStyle")
-            ET.SubElement(styled_line, "color").text = "ff0000ff"
-            ET.SubElement(styled_line, "width").text = "2"
-
-        line = ET.SubElement(placemark, "LineString")
-
-        coord_str1 = str(x1) + "," + str(y1) + "," + str(z1)
-        coord_str2 = str(x2) + "," + str(y2) + "," + str(z2)
-        ET.SubElement(line, "coordinates").text = coord_str1 + " " + coord_str2
-        ET.SubElement(line, "altitudeMode").text = altitude_modes(altitude_mode)
-
-        extended_data = ET.SubElement(placemark, "ExtendedData")
-
-        for cell in range(len(headers)):
-            data = ET.SubElement(extended_data, "Data", name=str(headers[cell]))
-            ET.SubElement(data, "displayName").text = str(headers[cell])
-            ET.SubElement(data, "value").text = str(row[cell])
+    for placemark in _line_rows(csv_list, name_col_name, coord_col_names, altitude_mode, style_to_use, visibility,
+                                draw_order, compact_id, lines):
+        folder.append(placemark)
 
     return folder
 
 
 def solid_polygon(folder_name, poly_coords, attributes, name_col_name=None,
-                  altitude_mode="ctg", style_to_use=None, visibility=1):
+                  altitude_mode="ctg", style_to_use=None, visibility=1, compact=False, simplify_tolerance=None,
+                  simplify_method="vw"):
     """
     Creates a folder of solid KML polygons. Does not create polygons with holes
     :param folder_name: Name of folder that will hold polygons
-    :param poly_coords: [[[x y, z], [x y, z], [x y, z]], [poly 2], [poly 3]
+    :param poly_coords: [[[x y, z], [x y, z], [x y, z]], [poly 2], [poly 3] or Geometry.Rings
     :param attributes: [[Poly 1 Attributes], [Poly 2 Attributes]]
     :param name_col_name: Name of the column that contains polygon names
     :param altitude_mode: Abbreviated altitude mode (Optional)
     :param style_to_use: Name of polygon style to use (Optional)
     :param visibility: 1 = Visible, 0 = Invisible (Optional)
+    :param compact: True = declare the columns once in a Schema, write SchemaData instead of Data and
+                    replace each description with a shared BalloonStyle.
+                    Add compact_styles(folder_name, attributes[0], style_to_use) to the styles of kml_build (Optional)
+    :param simplify_tolerance: Removes vertices that change a polygon by less than this many meters (Optional)
+    :param simplify_method: "vw" = Visvalingam-Whyatt, "dp" = Douglas-Peucker (Optional)
     :return: A folder of polygons - an XML element as an object
     """
+    folder = _folder(folder_name, visibility)
+    compact_id = schema_id(folder_name) if compact else None
 
-    outer_poly_coords = poly_coords
+    for placemark in _polygon_rows(poly_coords, attributes, name_col_name, altitude_mode, style_to_use, visibility,
+                                   compact_id, simplify_tolerance, simplify_method):
+        folder.append(placemark)
 
-    folder = ET.Element("Folder")
-    ET.SubElement(folder, "name").text = str(folder_name)
-    ET.SubElement(folder, "visibility").text = str(visibility)
+    return folder
 
-    headers = [header for header in attributes[0]]
-    name_col_index = headers.index(name_col_name)
-    cdata_list = []
-    extended_data_list = []
 
-    for row in attributes[1:]:
-        row_attributes = [cell for cell in row]
-        # print(attributes)
-        attribute_str = "<![CDATA["
+def _track_placemark(track_id, coords, times, length, max_segment, altitude_mode, style_to_use, visibility,
+                     gx_track, simplify_tolerance, simplify_method):
+    """
+    Creates the placemark of one track
+    :param track_id: Track id, used as the placemark name
+    :param coords: List of (x, y, z, position)
+    :param times: List of times, one per coordinate
+    :param length: Total length of the track in meters
+    :param max_segment: Length of the longest segment in meters
+    :param altitude_mode: Full altitude mode
+    :param style_to_use: Name of line style to use
+    :param visibility: 1 = Visible, 0 = Invisible
+    :param gx_track: True = gx:Track with a time for each coordinate, False = LineString
+    :param simplify_tolerance: meters. Vertices are removed with GIS_Basics.simplify_line when set.
+    :param simplify_method: "vw" or "dp"
+    :return: A placemark - an XML element as an object
+    """
+    if simplify_tolerance:
+        coords = GIS_Basics.simplify_line(coords, simplify_tolerance, simplify_method)
+
+    summary_headers = ["Track", "Points", "Start", "End", "Length (m)", "Max Segment (m)"]
+    summary_values = [track_id, len(times), times[0], times[-1], length, max_segment]
+
+    placemark = ET.Element("Placemark")
+    ET.SubElement(placemark, "name").text = str(track_id)
+    ET.SubElement(placemark, "visibility").text = str(visibility)
+    ET.SubElement(placemark, "description").text = _description(summary_headers, summary_values)
+    if style_to_use is not None:
+        ET.SubElement(placemark, "styleUrl").text = style_to_use
+
+    if gx_track:
+        track = ET.SubElement(placemark, "gx:Track")
+        ET.SubElement(track, "altitudeMode").text = altitude_mode
+        for coord_set in coords:
+            ET.SubElement(track, "when").text = str(times[coord_set[3]])
+        for coord_set in coords:
+            ET.SubElement(track, "gx:coord").text = str(coord_set[0]) + " " + str(coord_set[1]) + " " + str(
+                int(coord_set[2]))
+    else:
+        line = ET.SubElement(placemark, "LineString")
+        ET.SubElement(line, "coordinates").text = " ".join(
+            [str(coord_set[0]) + "," + str(coord_set[1]) + "," + str(int(coord_set[2])) for coord_set in coords])
+        ET.SubElement(line, "altitudeMode").text = altitude_mode
 
-        for cell in range(len(headers)):
-            attribute_str += "<b>" + str(headers[cell]) + "</b>: " + str(row_attributes[cell]) + "<br>"
-        attribute_str += "]]>"
+    _extended_data(placemark, summary_headers, summary_values)
 
-        cdata_list.append(attribute_str)
+    return placemark
 
-        extended_data = ET.Element("ExtendedData")
-        for cell in range(len(headers)):
-            data = ET.SubElement(extended_data, "Data", name=str(headers[cell]))
-            ET.SubElement(data, "displayName").text = str(headers[cell])
-            ET.SubElement(data, "value").text = str(row[cell])
-        extended_data_list.append(extended_data)
 
-    count = 0
-    for outer_poly in outer_poly_coords:
-        outer_boundary_coord_str = ""
-        for coord_set in outer_poly:
-            try:
-                x = float(coord_set[0])
-                y = float(coord_set[1])
-                z = int(float(coord_set[2]))
-
-                outer_boundary_coord_str += str(x) + "," + str(y) + "," + str(z) + " "
-            except ValueError:
-                pass
-        first_coord = outer_boundary_coord_str[:outer_boundary_coord_str.index(" ")]
-        outer_boundary_coord_str += first_coord
+def _track_rows(rows, track_col_name, time_col_name, coord_col_names, altitude_mode, style_to_use, visibility,
+                gx_track=False, simplify_tolerance=None, simplify_method="vw"):
+    """
+    Creates one placemark per track from point rows sorted by track id and time.
+    Only the track being built is held in memory.
+    :param rows: Iterable of rows. The first row must be the header row.
+    :param track_col_name: Name of the column that contains track ids
+    :param time_col_name: Name of the column that contains times
+    :param coord_col_names: List of x, y, z cols names : [x_col_name, y_col_name, z_col_name]
+    :param altitude_mode: Abbreviated altitude mode
+    :param style_to_use: Name of line style to use
+    :param visibility: 1 = Visible, 0 = Invisible
+    :param gx_track: True = gx:Track, False = LineString
+    :param simplify_tolerance: meters (Optional)
+    :param simplify_method: "vw" or "dp"
+    :return: generator of placemarks - XML elements as objects
+    """
+    rows = iter(rows)
+    headers = next(rows)
+    cols_to_index = [track_col_name, time_col_name] + list(coord_col_names[:3])
+    col_indexes = [headers.index(col) for col in cols_to_index]
+    full_altitude_mode = altitude_modes(altitude_mode)
 
-        placemark = ET.SubElement(folder, "Placemark")
-        ET.SubElement(placemark, "name").text = str(attributes[count + 1][name_col_index])
-        ET.SubElement(placemark, "visibility").text = str(visibility)
-        ET.SubElement(placemark, "description").text = cdata_list[count]
-        if style_to_use is not None:
-            ET.SubElement(placemark, "styleUrl").text = style_to_use
-        polygon = ET.SubElement(placemark, "Polygon")
+    track_id = None
+    coords = []
+    times = []
+    length = 0
+    max_segment = 0
 
-        outer_boundary = ET.SubElement(polygon, "outerBoundaryIs")
-        outer_linear_ring = ET.SubElement(outer_boundary, "LinearRing")
-        ET.SubElement(outer_linear_ring, "coordinates").text = outer_boundary_coord_str
+    for row in rows:
+        try:
+            x = float(row[col_indexes[2]])
+            y = float(row[col_indexes[3]])
+            z = float(row[col_indexes[4]])
+        except (ValueError, IndexError):
+            continue
 
-        ET.SubElement(polygon, "altitudeMode").text = altitude_modes(altitude_mode)
-        placemark.append(extended_data_list[count])
+        if row[col_indexes[0]] != track_id:
+            if coords:
+                yield _track_placemark(track_id, coords, times, round(length), round(max_segment), full_altitude_mode,
+                                       style_to_use, visibility, gx_track, simplify_tolerance, simplify_method)
+            track_id = row[col_indexes[0]]
+            coords = []
+            times = []
+            length = 0
+            max_segment = 0
+        elif coords:
+            last = coords[-1]
+            # summed unrounded and rounded once, so short segments do not each lose a fraction of a meter
+            segment = GIS_Basics.coord_dist_3d([last[0], last[1], last[2], x, y, z], rounded=False)
+            length += segment
+            max_segment = max(max_segment, segment)
+
+        coords.append((x, y, z, len(times)))
+        times.append(row[col_indexes[1]])
+
+    if coords:
+        yield _track_placemark(track_id, coords, times, round(length), round(max_segment), full_altitude_mode,
+                               style_to_use, visibility, gx_track, simplify_tolerance, simplify_method)
+
+
+def tracks(csv_list, folder_name, track_col_name, time_col_name, coord_col_names, altitude_mode="ctg",
+           style_to_use=None, description=None, visibility=1, gx_track=False, simplify_tolerance=None,
+           simplify_method="vw"):
+    """
+    Creates a folder with one multi-vertex line per track from point rows.
+    Rows must be sorted by track id, then time. A track id that appears again later starts a new line.
+    Each line carries its point count, start and end time, total length and longest segment,
+    measured with GIS_Basics.coord_dist_3d.
+    :param csv_list: CSV list or iterable of rows, such as a csv.reader. The first row must be the header row.
+    :param folder_name: Name of folder that will hold tracks
+    :param track_col_name: Name of the column that contains track ids
+    :param time_col_name: Name of the column that contains times (ISO 8601 for gx:Track)
+    :param coord_col_names: List of x, y, z cols names : [x_col_name, y_col_name, z_col_name]
+    :param altitude_mode: Abbreviated altitude mode (Optional)
+    :param style_to_use: Name of line style to use (Optional)
+    :param description: Description of layer (Optional)
+    :param visibility: 1 = Visible, 0 = Invisible (Optional)
+    :param gx_track: True = gx:Track with a time for each point, False = LineString (Optional)
+    :param simplify_tolerance: Removes vertices that change a track by less than this many meters (Optional)
+    :param simplify_method: "vw" = Visvalingam-Whyatt, "dp" = Douglas-Peucker (Optional)
+    :return: A folder of tracks - an XML element as an object
+    """
+    folder = _folder(folder_name, visibility, description)
 
-        count += 1
+    for placemark in _track_rows(csv_list, track_col_name, time_col_name, coord_col_names, altitude_mode, style_to_use,
+                                 visibility, gx_track, simplify_tolerance, simplify_method):
+        folder.append(placemark)
 
     return folder
 
@@ -353,6 +799,7 @@ def doc_setup(name, description=None):
     :return: XML object of KML document
     """
     kml = ET.Element('kml', xmlns="http://www.opengis.net/kml/2.2")
+    kml.set("xmlns:gx", "http://www.google.com/kml/ext/2.2")
     doc = ET.SubElement(kml, "Document")
     ET.SubElement(doc, "name").text = name
     if description is not None:
@@ -361,6 +808,94 @@ def doc_setup(name, description=None):
     return kml
 
 
+def _escape_text(text):
+    """
+    Escapes element text for XML, leaving any <![CDATA[ ... ]]> sections as written
+    :param text: element text or tail
+    :return: escaped text
+    """
+    cdata_start = text.find("<![CDATA[")
+    if cdata_start == -1:
+        return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+    escaped = []
+    position = 0
+    while cdata_start != -1:
+        cdata_end = text.find("]]>", cdata_start)
+        if cdata_end == -1:
+            break
+        cdata_end += len("]]>")
+        escaped.append(text[position:cdata_start].replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;"))
+        escaped.append(text[cdata_start:cdata_end])
+        position = cdata_end
+        cdata_start = text.find("<![CDATA[", position)
+    escaped.append(text[position:].replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;"))
+
+    return "".join(escaped)
+
+
+def _escape_attribute(value):
+    """
+    Escapes an attribute value the same way ElementTree does
+    :param value: attribute value
+    :return: escaped attribute value
+    """
+    value = value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+    return value.replace("\r", "&#13;").replace("\n", "&#10;").replace("\t", "&#09;")
+
+
+def _write_start(elem, write):
+    """
+    Writes the start tag and text of an element
+    :param elem: XML element
+    :param write: callable that accepts a string
+    :return: True if the element was written as an empty tag
+    """
+    write("<" + elem.tag)
+    for key, value in elem.items():
+        write(" " + key + '="' + _escape_attribute(value) + '"')
+    if elem.text or len(elem):
+        write(">")
+        if elem.text:
+            write(_escape_text(elem.text))
+        return False
+    write(" />")
+    return True
+
+
+def _write_element(elem, write):
+    """
+    Serializes an element and its children in a single pass.
+    Text wrapped in <![CDATA[ ]]> is written as a real CDATA section.
+    :param elem: XML element
+    :param write: callable that accepts a string
+    :return: Writes element to write
+    """
+    if elem.tag is raw_fragment:
+        write(elem.text)
+    elif elem.tag is ET.Comment:
+        write("<!--" + elem.text + "-->")
+    elif elem.tag is ET.ProcessingInstruction:
+        write("<?" + elem.text + "?>")
+    elif not _write_start(elem, write):
+        for child in elem:
+            _write_element(child, write)
+        write("</" + elem.tag + ">")
+    if elem.tail:
+        write(_escape_text(elem.tail))
+
+
+def element_string(elem):
+    """
+    Serializes an XML element to a KML string. Non-ASCII characters are written as character references.
+    :param elem: XML element
+    :return: element as a string
+    """
+    parts = []
+    _write_element(elem, parts.append)
+    return "".join(parts).encode("ascii", "xmlcharrefreplace").decode("ascii")
+
+
 def kml_build(doc, styles, folders):
     """
     Brings KML elements together as a KML doc
@@ -377,36 +912,633 @@ def kml_build(doc, styles, folders):
     for each in folders:
         ET.Element.append(xml_doc, each)
 
-    kml_str = str(ET.tostring(whole_doc), 'utf-8')
+    # serializes in one pass, writing <![CDATA[]]> descriptions without escaping them
+    kml_str = element_string(whole_doc)
+
+    return kml_str
+
+
+class KMLWriter:
+    """
+    Writes a KML document to an open text file one fragment at a time.
+    Styles, folders and placemarks are serialized and written as soon as they are created,
+    so memory use does not grow with the number of rows.
+
+    Output matches kml_build when styles and folders are written in the same order.
+    """
+
+    def __init__(self, file_obj, name, description=None):
+        """
+        Writes the start of the KML document
+        :param file_obj: Text file object to write to
+        :param name: Name of KML document, not KML file. Name will appear when KML is opened.
+        :param description: Optional. Will appear below Name when opened.
+        """
+        self.file_obj = file_obj
+        self.name = name
+        self.folder_names = []
+        # ids of the Schemas written so far, which compact placemarks refer to
+        self.schema_ids = set()
+        self.closed = False
+
+        kml = ET.Element('kml', xmlns="http://www.opengis.net/kml/2.2")
+        kml.set("xmlns:gx", "http://www.google.com/kml/ext/2.2")
+        doc = ET.SubElement(kml, "Document")
+        ET.SubElement(doc, "name").text = name
+        if description is not None:
+            ET.SubElement(doc, "description").text = str(description)
+
+        _write_start(kml, self._write)
+        _write_start(doc, self._write)
+        for child in doc:
+            self.write_element(child)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write(self, text):
+        self.file_obj.write(text.encode("ascii", "xmlcharrefreplace").decode("ascii"))
+
+    def write_element(self, elem):
+        """
+        Serializes an element and writes it to the file
+        :param elem: XML element
+        :return: Writes element to file
+        """
+        _write_element(elem, self._write)
+
+    def write_fragment(self, fragment):
+        """
+        Writes already serialized KML, such as the output of element_string
+        :param fragment: KML string
+        :return: Writes fragment to file
+        """
+        self._write(fragment)
+
+    def _compact_id(self, compact):
+        """
+        Schema id for compact placemarks, taken from the innermost open folder
+        """
+        if not compact:
+            return None
+        compact_id = schema_id(self.folder_names[-1] if self.folder_names else self.name)
+        if compact_id not in self.schema_ids:
+            raise ValueError("No Schema written for " + compact_id + ". Write compact_styles with write_styles "
+                             "before opening any folder.")
+        return compact_id
+
+    def _write_rows(self, elements):
+        """
+        Writes placemarks
+        :return: Number of placemarks written
+        """
+        count = 0
+        for elem in elements:
+            self.write_element(elem)
+            if elem.tag == "Placemark" or elem.tag is raw_fragment:
+                count += 1
+        return count
+
+    def write_styles(self, styles):
+        """
+        Writes styles to the document. Schemas, such as those from compact_styles, must be written
+        before any folder is opened.
+        :param styles: A list of styles to include
+        :return: Writes styles to file
+        """
+        for style in styles:
+            if style.tag == "Schema":
+                if self.folder_names:
+                    raise ValueError("A Schema must be written before any folder is opened")
+                self.schema_ids.add(style.get("id"))
+            self.write_element(style)
+
+    def open_folder(self, folder_name, visibility=1, description=None):
+        """
+        Starts a new folder. Folders can be nested.
+        :param folder_name: Name of folder
+        :param visibility: 1 = Visible, 0 = Invisible (Optional)
+        :param description: Description of layer (Optional)
+        :return: Writes the start of the folder to file
+        """
+        folder = _folder(folder_name, visibility, description)
+        _write_start(folder, self._write)
+        for child in folder:
+            self.write_element(child)
+        self.folder_names.append(folder_name)
+
+    def close_folder(self):
+        """
+        Ends the most recently opened folder
+        :return: Writes the end of the folder to file
+        """
+        if not self.folder_names:
+            raise ValueError("No open folder to close")
+        self._write("</Folder>")
+        self.folder_names.pop()
+
+    def write_placemarks(self, rows, name_col_name, coord_col_names, altitude_mode="ctg", style_to_use=None,
+                         visibility=1, compact=False, cache=None, points=None):
+        """
+        Writes point placemarks one row at a time. Uses the same markup as placemarks.
+        :param rows: Iterable of rows, such as a csv.reader. The first row must be the header row.
+        :param name_col_name: Name of the column that contains placemark names
+        :param coord_col_names: List of x, y, z cols names : [x_col_name, y_col_name, z_col_name]
+        :param altitude_mode: Abbreviated altitude mode (Optional)
+        :param style_to_use: Name of point style to use (Optional)
+        :param visibility: 1 = Visible, 0 = Invisible (Optional)
+        :param compact: True = Schema/SimpleData output named after the open folder. See placemarks.
+                        The folder's compact_styles must already be written.
+        :param cache: KML_Cache.FragmentCache. See placemarks. (Optional)
+        :param points: Geometry.Points built from the same rows. See placemarks. (Optional)
+        :return: Number of placemarks written
+        """
+        return self._write_rows(_point_rows(rows, name_col_name, coord_col_names, altitude_mode, style_to_use,
+                                            visibility, self._compact_id(compact), cache, points))
+
+    def write_two_point_lines(self, rows, name_col_name, coord_col_names, altitude_mode="ctg", style_to_use=None,
+                              visibility=1, draw_order=0, compact=False, lines=None):
+        """
+        Writes two point lines one row at a time. Uses the same markup as two_point_line.
+        :param rows: Iterable of rows, such as a csv.reader. The first row must be the header row.
+        :param name_col_name: Name of the column that contains line names
+        :param coord_col_names: A list of col names : [x1_col_name, y1_col_name, z1_col_name, x2_col_name, y2_col_name, z2_col_name]
+        :param altitude_mode: Abbreviated altitude mode (Optional)
+        :param style_to_use: Name of line style to use (Optional)
+        :param visibility: 1 = Visible, 0 = Invisible (Optional)
+        :param draw_order: order of rendering (Higher values render first)
+        :param compact: True = Schema/SimpleData output named after the open folder. See placemarks.
+                        The folder's compact_styles must already be written.
+        :param lines: Geometry.Lines built from the same rows. See two_point_line. (Optional)
+        :return: Number of lines written
+        """
+        return self._write_rows(_line_rows(rows, name_col_name, coord_col_names, altitude_mode, style_to_use,
+                                           visibility, draw_order, self._compact_id(compact), lines))
+
+    def write_polygons(self, poly_coords, attributes, name_col_name=None, altitude_mode="ctg", style_to_use=None,
+                       visibility=1, compact=False, simplify_tolerance=None, simplify_method="vw"):
+        """
+        Writes solid polygons one polygon at a time. Uses the same markup as solid_polygon.
+        :param poly_coords: Iterable of polygons : [[[x y, z], [x y, z], [x y, z]], [poly 2], [poly 3]
+        :param attributes: Iterable of attribute rows. The first row must be the header row.
+        :param name_col_name: Name of the column that contains polygon names
+        :param altitude_mode: Abbreviated altitude mode (Optional)
+        :param style_to_use: Name of polygon style to use (Optional)
+        :param visibility: 1 = Visible, 0 = Invisible (Optional)
+        :param compact: True = Schema/SimpleData output named after the open folder. See placemarks.
+                        The folder's compact_styles must already be written.
+        :param simplify_tolerance: meters. See solid_polygon. (Optional)
+        :param simplify_method: "vw" or "dp" (Optional)
+        :return: Number of polygons written
+        """
+        return self._write_rows(_polygon_rows(poly_coords, attributes, name_col_name, altitude_mode, style_to_use,
+                                              visibility, self._compact_id(compact), simplify_tolerance,
+                                              simplify_method))
+
+    def write_tracks(self, rows, track_col_name, time_col_name, coord_col_names, altitude_mode="ctg",
+                     style_to_use=None, visibility=1, gx_track=False, simplify_tolerance=None, simplify_method="vw"):
+        """
+        Writes one line per track while reading point rows. Uses the same markup as tracks.
+        :param rows: Iterable of rows sorted by track id, then time. The first row must be the header row.
+        :param track_col_name: Name of the column that contains track ids
+        :param time_col_name: Name of the column that contains times
+        :param coord_col_names: List of x, y, z cols names : [x_col_name, y_col_name, z_col_name]
+        :param altitude_mode: Abbreviated altitude mode (Optional)
+        :param style_to_use: Name of line style to use (Optional)
+        :param visibility: 1 = Visible, 0 = Invisible (Optional)
+        :param gx_track: True = gx:Track, False = LineString (Optional)
+        :param simplify_tolerance: meters. See tracks. (Optional)
+        :param simplify_method: "vw" or "dp" (Optional)
+        :return: Number of tracks written
+        """
+        return self._write_rows(_track_rows(rows, track_col_name, time_col_name, coord_col_names, altitude_mode,
+                                            style_to_use, visibility, gx_track, simplify_tolerance, simplify_method))
+
+    def close(self):
+        """
+        Closes any open folders and ends the document. Does not close the file object.
+        :return: Writes the end of the document to file
+        """
+        if self.closed:
+            return
+        while self.folder_names:
+            self.close_folder()
+        self._write("</Document></kml>")
+        self.closed = True
+
+
+def kmz_write(file_path, kml_str):
+    """
+    Writes a KML string to a zip-compressed KMZ file
+    :param file_path: Path of .kmz file to write to
+    :param kml_str: KML as a string, such as the output of kml_build
+    :return: Writes KMZ file
+    """
+    with zipfile.ZipFile(file_path, "w", zipfile.ZIP_DEFLATED) as kmz:
+        kmz.writestr("doc.kml", kml_str)
+
+
+def _placemark_chunk(chunk):
+    """
+    Creates and serializes the point placemarks of one chunk of rows. Runs in a worker process.
+    :param chunk: (headers, rows, name_col_name, coord_col_names, altitude_mode, style_to_use, visibility)
+    :return: (number of placemarks, placemarks as a KML string)
+    """
+    headers, rows, name_col_name, coord_col_names, altitude_mode, style_to_use, visibility = chunk
+    placemark_rows = _point_rows([headers] + rows, name_col_name, coord_col_names, altitude_mode, style_to_use,
+                                 visibility)
+    fragments = [element_string(placemark) for placemark in placemark_rows]
+    return len(fragments), "".join(fragments)
+
 
-    # replacements to fix CDATA XML escaped characters
-    # counts <![CDATA[]]> occurrences
-    last_found = -1
-    cdata = []
+def _row_chunks(rows, chunk_size, *settings):
+    """
+    Splits rows into chunks that each carry the header row and placemark settings
+    :param rows: Iterable of rows. The first row must be the header row.
+    :param chunk_size: Number of rows per chunk
+    :param settings: placemark settings passed through to each chunk
+    :return: generator of chunks
+    """
+    rows = iter(rows)
+    headers = next(rows)
     while True:
-        last_found = kml_str.find("&lt;![CDATA[", last_found + 1)
-        if last_found == -1:
+        chunk_rows = list(islice(rows, chunk_size))
+        if not chunk_rows:
             break
-        cdata.append(last_found)
+        yield (headers, chunk_rows) + settings
+
+
+def kmz_placemarks(file_path, csv_list, doc_name, folder_name, name_col_name, coord_col_names, styles=None,
+                   altitude_mode="ctg", style_to_use=None, description=None, visibility=1, chunk_size=5000,
+                   processes=None):
+    """
+    Writes a KMZ file with a single folder of point placemarks.
+    Rows are split into chunks that are built and serialized in a process pool, then written in order.
+    On platforms that spawn processes, call from within an if __name__ == "__main__": block.
+    :param file_path: Path of .kmz file to write to
+    :param csv_list: CSV list or iterable of rows. The first row must be the header row.
+    :param doc_name: Name of KML document
+    :param folder_name: Name of folder that will hold placemarks
+    :param name_col_name: Name of the column that contains placemark names
+    :param coord_col_names: List of x, y, z cols names : [x_col_name, y_col_name, z_col_name]
+    :param styles: A list of styles to include (Optional)
+    :param altitude_mode: Abbreviated altitude mode (Optional)
+    :param style_to_use: Name of point style to use (Optional)
+    :param description: Description of layer (Optional)
+    :param visibility: 1 = Visible, 0 = Invisible (Optional)
+    :param chunk_size: Number of rows serialized by a worker at a time
+    :param processes: Number of worker processes. None = all cores, 1 = no process pool
+    :return: Number of placemarks written
+    """
+    chunks = _row_chunks(csv_list, chunk_size, name_col_name, coord_col_names, altitude_mode, style_to_use,
+                         visibility)
+    count = 0
 
-    cdata_count = len(cdata)
+    with zipfile.ZipFile(file_path, "w", zipfile.ZIP_DEFLATED) as kmz:
+        with io.TextIOWrapper(kmz.open("doc.kml", "w"), encoding="ascii") as kml_file:
+            with KMLWriter(kml_file, doc_name) as writer:
+                writer.write_styles(styles or [])
+                writer.open_folder(folder_name, visibility, description)
 
-    # Replaces XML escaped characters in <![CDATA[]]>
-    for x in range(0, cdata_count):
-        cdata_start = kml_str.find("&lt;![CDATA[")
-        cdata_end = kml_str.find("]]&gt;") + len("]]&gt;")
+                if processes == 1:
+                    for chunk_count, fragment in map(_placemark_chunk, chunks):
+                        writer.write_fragment(fragment)
+                        count += chunk_count
+                else:
+                    with Pool(processes) as pool:
+                        # a few chunks in flight at a time, written in the same order as the rows
+                        results = CSV_Tools.bounded_imap(lambda chunk: pool.apply_async(_placemark_chunk, (chunk,)).get,
+                                                         chunks, 2 * (processes or os.cpu_count() or 1))
+                        for _, (chunk_count, fragment) in results:
+                            writer.write_fragment(fragment)
+                            count += chunk_count
 
-        str_1 = kml_str[:cdata_start]
-        str_2 = kml_str[cdata_end:]
-        substring = kml_str[cdata_start:cdata_end]
+                writer.close_folder()
 
-        substring = substring.replace("&lt;", "<")
-        substring = substring.replace("&gt;", ">")
-        substring = substring.replace("&amp;", "&")
-        substring = substring.replace("&quot;", '"')
-        substring = substring.replace("&apos;", "'")
+    return count
 
-        kml_str = str_1 + substring + str_2
 
-    return kml_str
+def region(west, south, east, north, min_lod_pixels=128, max_lod_pixels=-1):
+    """
+    Creates a KML Region. Features in the Region are only drawn while the Region's bounds
+    take up between min_lod_pixels and max_lod_pixels on screen.
+    :param west: Western bound (longitude)
+    :param south: Southern bound (latitude)
+    :param east: Eastern bound (longitude)
+    :param north: Northern bound (latitude)
+    :param min_lod_pixels: Size in pixels the Region must reach before it is active
+    :param max_lod_pixels: Size in pixels above which the Region is no longer active. -1 = no limit
+    :return: a Region - an XML element as an object
+    """
+    kml_region = ET.Element("Region")
+    box = ET.SubElement(kml_region, "LatLonAltBox")
+    ET.SubElement(box, "north").text = str(north)
+    ET.SubElement(box, "south").text = str(south)
+    ET.SubElement(box, "east").text = str(east)
+    ET.SubElement(box, "west").text = str(west)
+    lod = ET.SubElement(kml_region, "Lod")
+    ET.SubElement(lod, "minLodPixels").text = str(min_lod_pixels)
+    ET.SubElement(lod, "maxLodPixels").text = str(max_lod_pixels)
+
+    return kml_region
+
+
+def network_link(name, href, link_region=None):
+    """
+    Creates a KML NetworkLink that loads another KML file when its Region becomes active
+    :param name: Name of the link
+    :param href: Path or url of the KML file to load
+    :param link_region: Region that controls when the file is loaded (Optional)
+    :return: a NetworkLink - an XML element as an object
+    """
+    link = ET.Element("NetworkLink")
+    ET.SubElement(link, "name").text = str(name)
+    if link_region is not None:
+        link.append(link_region)
+    kml_link = ET.SubElement(link, "Link")
+    ET.SubElement(kml_link, "href").text = href
+    ET.SubElement(kml_link, "viewRefreshMode").text = "onRegion"
+
+    return link
+
+
+def _quadtree_split(points, bounds):
+    """
+    Splits points into the four quadrants of their bounds
+    :param points: List of (row index, x, y)
+    :param bounds: [west, south, east, north]
+    :return: List of (quadrant number, quadrant bounds, quadrant points) for quadrants that contain points
+    """
+    west, south, east, north = bounds
+    mid_x = (west + east) / 2
+    mid_y = (south + north) / 2
+    quadrant_bounds = [[west, mid_y, mid_x, north], [mid_x, mid_y, east, north],
+                       [west, south, mid_x, mid_y], [mid_x, south, east, mid_y]]
+    quadrant_points = [[], [], [], []]
+
+    for point in points:
+        quadrant = (0 if point[1] < mid_x else 1) + (0 if point[2] >= mid_y else 2)
+        quadrant_points[quadrant].append(point)
+
+    return [(quadrant, quadrant_bounds[quadrant], quadrant_points[quadrant])
+            for quadrant in range(4) if quadrant_points[quadrant]]
+
+
+def super_overlay(path, csv_list, doc_name, name_col_name, coord_col_names, styles=None, altitude_mode="ctg",
+                  style_to_use=None, max_per_tile=1000, max_depth=8, min_lod_pixels=128, kmz=False):
+    """
+    Writes points as a quadtree of small KML tiles (a "super-overlay").
+    Each tile holds up to max_per_tile placemarks and links to its child tiles through NetworkLinks with Regions,
+    so a viewer only loads the tiles that are visible at the current zoom.
+    A point appears in exactly one tile. Tiles that are split keep an even sample of their points.
+    :param path: Output folder for doc.kml and tiles/. Path of .kmz file if kmz is True.
+    :param csv_list: CSV list that contains necessary fields to create a placemark (x, y, z)
+    :param doc_name: Name of KML document
+    :param name_col_name: Name of the column that contains placemark names
+    :param coord_col_names: List of x, y, z cols names : [x_col_name, y_col_name, z_col_name]
+    :param styles: A list of styles to include in every tile (Optional)
+    :param altitude_mode: Abbreviated altitude mode (Optional)
+    :param style_to_use: Name of point style to use (Optional)
+    :param max_per_tile: Maximum number of placemarks in a tile
+    :param max_depth: Maximum depth of the quadtree. Tiles at this depth are not split.
+    :param min_lod_pixels: Size in pixels a tile must reach before it is loaded
+    :param kmz: True = write a single KMZ file, False = write KML files to a folder
+    :return: Number of tiles written
+    """
+    headers = csv_list[0]
+    x_col = headers.index(coord_col_names[0])
+    y_col = headers.index(coord_col_names[1])
+
+    points = []
+    for row_index in range(1, len(csv_list)):
+        try:
+            points.append((row_index, float(csv_list[row_index][x_col]), float(csv_list[row_index][y_col])))
+        except ValueError:
+            continue
+
+    if kmz:
+        archive = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+
+        def open_entry(name):
+            return io.TextIOWrapper(archive.open(name, "w"), encoding="ascii")
+    else:
+        archive = None
+        os.makedirs(os.path.join(path, "tiles"), exist_ok=True)
+
+        def open_entry(name):
+            return open(os.path.join(path, *name.split("/")), "w")
+
+    try:
+        with open_entry("doc.kml") as kml_file:
+            with KMLWriter(kml_file, doc_name) as writer:
+                if points:
+                    bounds = [min(p[1] for p in points), min(p[2] for p in points),
+                              max(p[1] for p in points), max(p[2] for p in points)]
+                    writer.write_element(network_link(doc_name, "tiles/r.kml", region(*bounds, min_lod_pixels=0)))
+
+        tile_count = 0
+        tiles = [("r", bounds, points, 0)] if points else []
+        while tiles:
+            key, bounds, tile_points, depth = tiles.pop()
+
+            if len(tile_points) <= max_per_tile or depth >= max_depth:
+                own_points = tile_points
+                children = []
+            else:
+                step = -(-len(tile_points) // max_per_tile)
+                own_points = tile_points[::step]
+                remaining = [point for count, point in enumerate(tile_points) if count % step != 0]
+                children = [(key + str(quadrant), quadrant_bounds, quadrant_points, depth + 1)
+                            for quadrant, quadrant_bounds, quadrant_points in _quadtree_split(remaining, bounds)]
+
+            with open_entry("tiles/" + key + ".kml") as kml_file:
+                with KMLWriter(kml_file, key) as writer:
+                    writer.write_element(region(*bounds, min_lod_pixels=0 if depth == 0 else min_lod_pixels))
+                    writer.write_styles(styles or [])
+                    writer.open_folder(key)
+                    writer.write_placemarks([headers] + [csv_list[point[0]] for point in own_points], name_col_name,
+                                            coord_col_names, altitude_mode, style_to_use)
+                    for child_key, child_bounds, child_points, child_depth in children:
+                        writer.write_element(network_link(child_key, child_key + ".kml",
+                                                          region(*child_bounds, min_lod_pixels=min_lod_pixels)))
+            tile_count += 1
+            tiles.extend(children)
+    finally:
+        if archive is not None:
+            archive.close()
+
+    return tile_count
+
+
+def _cluster_summary(csv_list, members, summary_col_indexes):
+    """
+    Summarizes the attributes of the rows in a cluster
+    :param csv_list: csv that has been converted to a 2D list.
+    :param members: row indexes of the rows in the cluster
+    :param summary_col_indexes: column indexes to summarize
+    :return: [summary headers], [summary values]
+    """
+    headers = ["Count"]
+    values = [len(members)]
+
+    for col in summary_col_indexes:
+        col_name = str(csv_list[0][col])
+        col_values = [csv_list[member][col] for member in members]
+        try:
+            numbers = [float(value) for value in col_values]
+            headers.extend([col_name + " (min)", col_name + " (max)", col_name + " (mean)"])
+            values.extend([min(numbers), max(numbers), round(sum(numbers) / len(numbers), 6)])
+        except ValueError:
+            headers.append(col_name + " (distinct)")
+            values.append(len(set(col_values)))
+
+    return headers, values
+
 
+def _cluster_level(points, cell_size, method):
+    """
+    Groups points into clusters
+    :param points: List of (row index, x, y, z)
+    :param cell_size: cluster size in meters
+    :param method: "grid" = one cluster per grid cell, "distance" = points join the nearest cluster within cell_size
+    :return: List of clusters. Each cluster is a list of points.
+    """
+    cells = {}
+
+    if method == "grid":
+        for point in points:
+            cell = GIS_Basics.grid_cell(point[1], point[2], cell_size)
+            cells.setdefault(cell, []).append(point)
+        return list(cells.values())
+
+    if method != "distance":
+        raise ValueError("method must be 'grid' or 'distance'")
+
+    # leaders are the first point of each cluster, bucketed by cell so only neighbouring cells are compared
+    clusters = []
+    for point in points:
+        nearest = None
+        nearest_dist = cell_size
+        for cell in GIS_Basics.grid_neighbours(point[1], point[2], cell_size):
+            for cluster in cells.get(cell, []):
+                leader = cluster[0]
+                dist = GIS_Basics.coord_dist([leader[1], leader[2], point[1], point[2]])
+                if dist <= nearest_dist:
+                    nearest = cluster
+                    nearest_dist = dist
+        if nearest is None:
+            nearest = []
+            cells.setdefault(GIS_Basics.grid_cell(point[1], point[2], cell_size), []).append(nearest)
+            clusters.append(nearest)
+        nearest.append(point)
+
+    return clusters
+
+
+def cluster_placemarks(csv_list, folder_name, name_col_name, coord_col_names, cell_sizes=(50000, 10000, 2000),
+                       method="grid", summary_col_names=None, altitude_mode="ctg", style_to_use=None,
+                       cluster_style_to_use=None, visibility=1, max_lod_pixels=1024):
+    """
+    Creates a folder of point clusters at several zoom levels with the real points below them.
+    Each cluster is a placemark at the centroid of its points that shows the point count and a summary of
+    the points' attributes. Regions hand each level over to the next as the viewer zooms in, ending with
+    the real points.
+    :param csv_list: CSV list that contains necessary fields to create a placemark (x, y, z)
+    :param folder_name: Name of folder that will hold clusters and placemarks
+    :param name_col_name: Name of the column that contains placemark names
+    :param coord_col_names: List of x, y, z cols names : [x_col_name, y_col_name, z_col_name]
+    :param cell_sizes: Cluster size in meters for each level, largest first
+    :param method: "grid" = cluster by grid cell, "distance" = cluster by GIS_Basics.coord_dist
+    :param summary_col_names: Columns to summarize in each cluster. Numbers get min/max/mean, text gets a
+                              distinct count (Optional)
+    :param altitude_mode: Abbreviated altitude mode (Optional)
+    :param style_to_use: Name of point style to use (Optional)
+    :param cluster_style_to_use: Name of style to use for clusters (Optional)
+    :param visibility: 1 = Visible, 0 = Invisible (Optional)
+    :param max_lod_pixels: Size in pixels a cluster's cell reaches before it gives way to the next level
+    :return: A folder of clusters and placemarks - an XML element as an object
+    """
+    headers = [header for header in csv_list[0]]
+    cols_to_index = [name_col_name] + list(coord_col_names[:3])
+    col_indexes = [headers.index(col) for col in cols_to_index]
+    summary_col_indexes = [headers.index(col) for col in summary_col_names or []]
+    full_altitude_mode = altitude_modes(altitude_mode)
+    cell_sizes = sorted(cell_sizes, reverse=True)
+
+    points = []
+    for row_index in range(1, len(csv_list)):
+        row = csv_list[row_index]
+        try:
+            x = float(row[col_indexes[1]])
+            y = float(row[col_indexes[2]])
+            z = int(float(row[col_indexes[3]]))
+        except (ValueError, OverflowError, IndexError):
+            continue
+        # nan and inf parse as floats but cannot be put in a grid cell
+        if isfinite(x) and isfinite(y):
+            points.append((row_index, x, y, z))
+
+    folder = _folder(folder_name, visibility)
+
+    for level in range(len(cell_sizes)):
+        cell_size = cell_sizes[level]
+        # a level appears when the previous level's cells reach max_lod_pixels
+        min_lod_pixels = 0 if level == 0 else int(max_lod_pixels * cell_size / cell_sizes[level - 1])
+        level_folder = ET.SubElement(folder, "Folder")
+        ET.SubElement(level_folder, "name").text = "Clusters (" + str(cell_size) + " m)"
+        ET.SubElement(level_folder, "visibility").text = str(visibility)
+
+        for cluster in _cluster_level(points, cell_size, method):
+            x = sum([point[1] for point in cluster]) / len(cluster)
+            y = sum([point[2] for point in cluster]) / len(cluster)
+            cell = GIS_Basics.grid_cell(x, y, cell_size)
+            cluster_region = region(*GIS_Basics.grid_cell_bounds(cell, cell_size), min_lod_pixels=min_lod_pixels,
+                                    max_lod_pixels=max_lod_pixels)
+
+            if len(cluster) == 1:
+                placemark = _point_placemark(csv_list[cluster[0][0]], headers, col_indexes, full_altitude_mode,
+                                             style_to_use, visibility)
+            else:
+                summary_headers, summary_values = _cluster_summary(csv_list, [point[0] for point in cluster],
+                                                                   summary_col_indexes)
+                z = int(round(sum([point[3] for point in cluster]) / len(cluster)))
+                placemark = ET.Element("Placemark")
+                ET.SubElement(placemark, "name").text = str(len(cluster))
+                ET.SubElement(placemark, "visibility").text = str(visibility)
+                ET.SubElement(placemark, "description").text = _description(summary_headers, summary_values)
+                if cluster_style_to_use is not None:
+                    ET.SubElement(placemark, "styleUrl").text = cluster_style_to_use
+                point = ET.SubElement(placemark, "Point")
+                ET.SubElement(point, "coordinates").text = str(x) + "," + str(y) + "," + str(z)
+                ET.SubElement(point, "altitudeMode").text = full_altitude_mode
+                _extended_data(placemark, summary_headers, summary_values)
+
+            # Region goes before the geometry
+            placemark.insert(list(placemark).index(placemark.find("Point")), cluster_region)
+            level_folder.append(placemark)
+
+    # real points appear when the smallest clusters' cells reach max_lod_pixels
+    points_folder = ET.SubElement(folder, "Folder")
+    ET.SubElement(points_folder, "name").text = "Points"
+    ET.SubElement(points_folder, "visibility").text = str(visibility)
+    finest_size = cell_sizes[-1] if cell_sizes else 0
+    point_cells = {}
+    for point in points:
+        cell = GIS_Basics.grid_cell(point[1], point[2], finest_size) if finest_size else (0, 0)
+        point_cells.setdefault(cell, []).append(point[0])
+
+    for cell, row_indexes in point_cells.items():
+        if finest_size:
+            cell_folder = ET.SubElement(points_folder, "Folder")
+            ET.SubElement(cell_folder, "name").text = str(cell[0]) + "_" + str(cell[1])
+            cell_folder.append(region(*GIS_Basics.grid_cell_bounds(cell, finest_size), min_lod_pixels=max_lod_pixels))
+        else:
+            cell_folder = points_folder
+        for row_index in row_indexes:
+            cell_folder.append(_point_placemark(csv_list[row_index], headers, col_indexes, full_altitude_mode,
+                                                style_to_use, visibility))
+
+    return folder
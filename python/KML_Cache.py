@@ -0,0 +1,106 @@
+import hashlib
+import sqlite3
+
+
+class FragmentCache:
+    """
+    On-disk cache of serialized KML fragments keyed by a hash of the row and the settings used to build it.
+    When the cache grows past max_bytes, the least recently used fragments are evicted.
+    Pass to KML_Build.placemarks or KMLWriter.write_placemarks as cache=.
+    """
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024):
+        """
+        Opens or creates a cache
+        :param path: Path of the cache file
+        :param max_bytes: Largest total size of cached fragments
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(path)
+        # lets the file shrink after eviction. Only takes effect when the file is created.
+        self.connection.execute("PRAGMA auto_vacuum = FULL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS fragments "
+                                "(key TEXT PRIMARY KEY, fragment TEXT, size INTEGER, used INTEGER)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS fragments_used ON fragments (used)")
+        self.clock = self.connection.execute("SELECT MAX(used) FROM fragments").fetchone()[0] or 0
+        self.used_keys = []
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def key(settings, row):
+        """
+        Hashes a row together with the settings that change how it is written
+        :param settings: tuple of settings such as headers, column indexes and style
+        :param row: List of attribute values
+        :return: hex digest
+        """
+        return hashlib.sha1(repr((settings, list(row))).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Looks up a fragment
+        :param key: key from FragmentCache.key
+        :return: fragment as a string, or None if it is not cached
+        """
+        found = self.connection.execute("SELECT fragment FROM fragments WHERE key = ?", (key,)).fetchone()
+        if found is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.used_keys.append(key)
+        return found[0]
+
+    def put(self, key, fragment):
+        """
+        Stores a fragment
+        :param key: key from FragmentCache.key
+        :param fragment: serialized KML
+        :return: Adds fragment to the cache
+        """
+        self.clock += 1
+        self.connection.execute("INSERT OR REPLACE INTO fragments VALUES (?, ?, ?, ?)",
+                                (key, fragment, len(fragment), self.clock))
+
+    def commit(self):
+        """
+        Records which fragments were used, evicts the least recently used fragments over max_bytes
+        and saves the cache to disk
+        :return: Number of fragments evicted
+        """
+        touched = []
+        for key in self.used_keys:
+            self.clock += 1
+            touched.append((self.clock, key))
+        self.connection.executemany("UPDATE fragments SET used = ? WHERE key = ?", touched)
+        self.used_keys = []
+
+        evicted = 0
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM fragments").fetchone()[0]
+        if total > self.max_bytes:
+            to_delete = []
+            for key, size in self.connection.execute("SELECT key, size FROM fragments ORDER BY used"):
+                if total <= self.max_bytes:
+                    break
+                to_delete.append((key,))
+                total -= size
+            self.connection.executemany("DELETE FROM fragments WHERE key = ?", to_delete)
+            evicted = len(to_delete)
+
+        self.connection.commit()
+        return evicted
+
+    def close(self):
+        """
+        Saves and closes the cache
+        :return: Closes cache file
+        """
+        self.commit()
+        self.connection.close()
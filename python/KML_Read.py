@@ -0,0 +1,148 @@
+import zipfile
+import xml.etree.ElementTree as ET
+
+GEOMETRY_TAGS = ("Point", "LineString", "LinearRing", "Polygon", "Track", "MultiGeometry")
+
+
+class _GxNamespaceFile:
+    """
+    Wraps a binary KML file and declares the gx: prefix on the root element when it is missing.
+    Files written by older versions of KML_Build use gx:drawOrder without declaring the prefix,
+    which XML parsers reject.
+    """
+
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.first_read = True
+
+    def read(self, size=-1):
+        if not self.first_read:
+            return self.file_obj.read(size)
+        self.first_read = False
+
+        data = self.file_obj.read(max(size, 65536))
+        root_start = data.find(b"<kml")
+        if root_start != -1:
+            root_end = data.find(b">", root_start)
+            if root_end != -1 and b"xmlns:gx" not in data[root_start:root_end]:
+                insert_at = root_start + len(b"<kml")
+                data = data[:insert_at] + b' xmlns:gx="http://www.google.com/kml/ext/2.2"' + data[insert_at:]
+        return data
+
+
+def _local_name(tag):
+    """
+    Removes the namespace from a tag
+    :param tag: tag such as {http://www.opengis.net/kml/2.2}Placemark
+    :return: tag without namespace such as Placemark
+    """
+    return tag.rsplit("}", 1)[-1]
+
+
+def _placemark_values(placemark):
+    """
+    Reads the name, geometry and attributes of a Placemark
+    :param placemark: Placemark - an XML element as an object
+    :return: name, geometry type, coordinates, dict of attributes, schemaUrl or None
+    """
+    name = ""
+    geometry = ""
+    coordinates = []
+    attributes = {}
+    schema_url = None
+
+    for elem in placemark.iter():
+        tag = _local_name(elem.tag)
+        if tag == "name" and elem in placemark:
+            name = elem.text or ""
+        elif tag in GEOMETRY_TAGS and not geometry:
+            geometry = tag
+        elif tag == "coordinates":
+            coordinates.append(" ".join((elem.text or "").split()))
+        elif tag == "coord":
+            coordinates.append(",".join((elem.text or "").split()))
+        elif tag == "Data":
+            value = ""
+            for child in elem:
+                if _local_name(child.tag) == "value":
+                    value = child.text or ""
+            attributes[elem.get("name")] = value
+        elif tag == "SchemaData":
+            schema_url = elem.get("schemaUrl")
+        elif tag == "SimpleData":
+            attributes[elem.get("name")] = elem.text or ""
+
+    if geometry == "Polygon":
+        # outer boundary only
+        coordinates = coordinates[:1]
+
+    return name, geometry, " ".join(coordinates), attributes, schema_url
+
+
+def _kml_source(file_path):
+    """
+    Opens a KML file, or the main KML file inside a KMZ archive
+    :param file_path: Path of .kml or .kmz file
+    :return: (binary file object, zip archive or None)
+    """
+    if not zipfile.is_zipfile(file_path):
+        return open(file_path, "rb"), None
+
+    archive = zipfile.ZipFile(file_path)
+    names = [name for name in archive.namelist() if name.lower().endswith(".kml")]
+    if not names:
+        archive.close()
+        raise ValueError("No KML file found in " + str(file_path))
+    main_name = "doc.kml" if "doc.kml" in names else names[0]
+    return archive.open(main_name), archive
+
+
+def kml_reader(file_path, fields=None):
+    """
+    Reads placemarks from a KML or KMZ file one at a time without loading the whole document.
+    Yields a header row first, then one row per placemark, so the output can be passed to csv_writer
+    and the CSV_Tools functions.
+    Columns are the ExtendedData fields, then "Placemark Name", "Geometry" and "Coordinates".
+    Polygons return their outer boundary. Tracks return their gx:coord values as x,y,z.
+    :param file_path: Path of .kml or .kmz file
+    :param fields: ExtendedData field names to read. Taken from the first placemark's Schema or Data if None.
+    :return: generator of rows
+    """
+    source, archive = _kml_source(file_path)
+    schemas = {}
+    header = None
+    open_elements = []
+
+    try:
+        for event, elem in ET.iterparse(_GxNamespaceFile(source), events=("start", "end")):
+            if event == "start":
+                open_elements.append(elem)
+                continue
+            open_elements.pop()
+            tag = _local_name(elem.tag)
+
+            if tag == "Schema":
+                schema_fields = [field.get("name") for field in elem if _local_name(field.tag) == "SimpleField"]
+                schemas["#" + str(elem.get("id") or elem.get("name"))] = schema_fields
+            elif tag == "Placemark":
+                name, geometry, coordinates, attributes, schema_url = _placemark_values(elem)
+                if header is None:
+                    if fields is None:
+                        fields = schemas.get(schema_url, list(attributes))
+                    header = list(fields) + ["Placemark Name", "Geometry", "Coordinates"]
+                    yield header
+                yield [attributes.get(field, "") for field in fields] + [name, geometry, coordinates]
+            else:
+                continue
+
+            # drops the finished element so memory does not grow with the document
+            elem.clear()
+            if open_elements:
+                open_elements[-1].remove(elem)
+
+        if header is None:
+            yield list(fields or []) + ["Placemark Name", "Geometry", "Coordinates"]
+    finally:
+        source.close()
+        if archive is not None:
+            archive.close()
@@ -0,0 +1,137 @@
+import io
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import isfinite
+from urllib.parse import urlparse, parse_qs
+import xml.etree.ElementTree as ET
+
+import CSV_Tools
+import KML_Build
+import Spatial_Index
+
+
+def root_kml(doc_name, placemarks_url, refresh_seconds=1):
+    """
+    Creates the KML a viewer opens first. Its NetworkLink requests placemarks for the current view
+    every time the camera stops moving.
+    :param doc_name: Name of KML document
+    :param placemarks_url: Full url of the placemarks endpoint
+    :param refresh_seconds: Seconds after the camera stops before the view is refreshed
+    :return: KML as a string
+    """
+    kml = KML_Build.doc_setup(doc_name)
+    link = ET.SubElement(kml[0], "NetworkLink")
+    ET.SubElement(link, "name").text = str(doc_name)
+    kml_link = ET.SubElement(link, "Link")
+    ET.SubElement(kml_link, "href").text = placemarks_url
+    ET.SubElement(kml_link, "viewRefreshMode").text = "onStop"
+    ET.SubElement(kml_link, "viewRefreshTime").text = str(refresh_seconds)
+    ET.SubElement(kml_link, "viewFormat").text = "BBOX=[bboxWest],[bboxSouth],[bboxEast],[bboxNorth]"
+
+    return KML_Build.kml_build(kml, [], [])
+
+
+def bbox_kml(csv_list, index, bbox, doc_name, name_col_name, coord_col_names, max_placemarks=1000, styles=None,
+             altitude_mode="ctg", style_to_use=None):
+    """
+    Creates KML of the placemarks inside a bounding box.
+    If more than max_placemarks points are inside, an even sample of them is returned.
+    :param csv_list: csv that has been converted to a 2D list.
+    :param index: Spatial_Index.GridIndex built from csv_list
+    :param bbox: [west, south, east, north]
+    :param doc_name: Name of KML document
+    :param name_col_name: Name of the column that contains placemark names
+    :param coord_col_names: List of x, y, z cols names : [x_col_name, y_col_name, z_col_name]
+    :param max_placemarks: Maximum number of placemarks to return
+    :param styles: A list of styles to include (Optional)
+    :param altitude_mode: Abbreviated altitude mode (Optional)
+    :param style_to_use: Name of point style to use (Optional)
+    :return: KML as a string
+    """
+    row_ids = sorted(index.bbox(*bbox))
+    if len(row_ids) > max_placemarks:
+        step = len(row_ids) / max_placemarks
+        row_ids = [row_ids[int(count * step)] for count in range(max_placemarks)]
+
+    kml_file = io.StringIO()
+    with KML_Build.KMLWriter(kml_file, doc_name) as writer:
+        writer.write_styles(styles or [])
+        writer.open_folder(doc_name)
+        writer.write_placemarks([csv_list[0]] + [csv_list[row_id] for row_id in row_ids], name_col_name,
+                                coord_col_names, altitude_mode, style_to_use)
+
+    return kml_file.getvalue()
+
+
+def make_server(file_path, name_col_name, coord_col_names, host="127.0.0.1", port=8000, max_placemarks=1000,
+                styles=None, altitude_mode="ctg", style_to_use=None, delimiter=",", encoding="utf-8"):
+    """
+    Loads a csv once, indexes its x/y columns and creates an HTTP server for it.
+    Open http://host:port/ in Google Earth. The view requests /placemarks.kml?BBOX=west,south,east,north
+    and receives only the placemarks inside the view.
+    :param file_path: full path to csv
+    :param name_col_name: Name of the column that contains placemark names
+    :param coord_col_names: List of x, y, z cols names : [x_col_name, y_col_name, z_col_name]
+    :param host: Host name to listen on
+    :param port: Port to listen on. 0 = any free port
+    :param max_placemarks: Maximum number of placemarks returned for one view
+    :param styles: A list of styles to include (Optional)
+    :param altitude_mode: Abbreviated altitude mode (Optional)
+    :param style_to_use: Name of point style to use (Optional)
+    :param delimiter: separation character
+    :param encoding: encoding of csv file
+    :return: ThreadingHTTPServer. Call serve_forever() to start it.
+    """
+    csv_list = CSV_Tools.csv_reader(file_path, delimiter, encoding)
+    index = Spatial_Index.GridIndex.from_csv_list(csv_list, coord_col_names[0], coord_col_names[1])
+    doc_name = str(file_path).replace("\\", "/").split("/")[-1]
+
+    class BBoxHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlparse(self.path)
+
+            if url.path in ("/", "/doc.kml"):
+                host_name = self.headers.get("Host", "%s:%s" % self.server.server_address[:2])
+                kml_str = root_kml(doc_name, "http://" + host_name + "/placemarks.kml")
+            elif url.path == "/placemarks.kml":
+                try:
+                    bbox = [float(value) for value in parse_qs(url.query)["BBOX"][0].split(",")]
+                    # nan and inf parse as floats but cannot be mapped to grid cells
+                    if len(bbox) != 4 or not all(isfinite(value) for value in bbox):
+                        raise ValueError
+                except (KeyError, ValueError):
+                    self.send_error(400, "BBOX=west,south,east,north is required")
+                    return
+                kml_str = bbox_kml(csv_list, index, bbox, doc_name, name_col_name, coord_col_names, max_placemarks,
+                                   styles, altitude_mode, style_to_use)
+            else:
+                self.send_error(404)
+                return
+
+            body = kml_str.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.google-earth.kml+xml")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), BBoxHandler)
+
+
+def serve(file_path, name_col_name, coord_col_names, host="127.0.0.1", port=8000, max_placemarks=1000, styles=None,
+          altitude_mode="ctg", style_to_use=None, delimiter=",", encoding="utf-8"):
+    """
+    Serves placemarks from a csv to Google Earth until interrupted. See make_server.
+    :return: Runs HTTP server
+    """
+    server = make_server(file_path, name_col_name, coord_col_names, host, port, max_placemarks, styles,
+                         altitude_mode, style_to_use, delimiter, encoding)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,294 @@
+import pickle
+from array import array
+from math import floor, sqrt, cos, radians, degrees, pi, isfinite
+
+import GIS_Basics
+
+
+class GridIndex:
+    """
+    Spatial index that buckets points into a grid of square cells measured in degrees.
+    Point ids are the row indexes of the points in the CSV list the index was built from.
+    Distances are in meters, measured with GIS_Basics.coord_dist.
+    """
+
+    def __init__(self, xs, ys, ids=None, cell_size=None):
+        """
+        Builds the index
+        :param xs: x coordinates (longitude)
+        :param ys: y coordinates (latitude)
+        :param ids: id of each point. Defaults to the position of each point.
+        :param cell_size: Width of grid cells in degrees. Chosen from the point density if None.
+        """
+        self.xs = array("d", xs)
+        self.ys = array("d", ys)
+        self.ids = array("q", ids if ids is not None else range(len(self.xs)))
+
+        if cell_size is None:
+            cell_size = self._auto_cell_size()
+        self.cell_size = float(cell_size)
+
+        self.cells = {}
+        for position in range(len(self.xs)):
+            key = (floor(self.xs[position] / self.cell_size), floor(self.ys[position] / self.cell_size))
+            cell = self.cells.get(key)
+            if cell is None:
+                self.cells[key] = [position]
+            else:
+                cell.append(position)
+
+    def __len__(self):
+        return len(self.xs)
+
+    @classmethod
+    def from_csv_list(cls, csv_list, x_col_name, y_col_name, cell_size=None):
+        """
+        Builds an index from the x and y columns of a 2D list. Rows without numeric coordinates are skipped.
+        :param csv_list: csv that has been converted to a 2D list.
+        :param x_col_name: Name of x column
+        :param y_col_name: Name of y column
+        :param cell_size: Width of grid cells in degrees (Optional)
+        :return: GridIndex
+        """
+        x_col = csv_list[0].index(x_col_name)
+        y_col = csv_list[0].index(y_col_name)
+
+        xs = array("d")
+        ys = array("d")
+        ids = array("q")
+        for row_index in range(1, len(csv_list)):
+            try:
+                x = float(csv_list[row_index][x_col])
+                y = float(csv_list[row_index][y_col])
+            except (ValueError, IndexError):
+                continue
+            # nan and inf parse as floats but cannot be put in a grid cell
+            if not (isfinite(x) and isfinite(y)):
+                continue
+            xs.append(x)
+            ys.append(y)
+            ids.append(row_index)
+
+        return cls(xs, ys, ids, cell_size)
+
+    def _auto_cell_size(self):
+        """
+        Picks a cell size that puts roughly 8 points in each occupied cell
+        :return: cell size in degrees
+        """
+        if len(self.xs) == 0:
+            return 1.0
+        width = max(self.xs) - min(self.xs)
+        height = max(self.ys) - min(self.ys)
+        if width * height == 0:
+            return max(width, height, 0.01) / sqrt(len(self.xs) / 8 + 1)
+        return max(sqrt(width * height * 8 / len(self.xs)), 1e-6)
+
+    def _cells_in(self, west, south, east, north):
+        """
+        Finds the occupied cells that overlap a box
+        :return: generator of cell contents (lists of point positions)
+        """
+        min_col = floor(west / self.cell_size)
+        max_col = floor(east / self.cell_size)
+        min_row = floor(south / self.cell_size)
+        max_row = floor(north / self.cell_size)
+
+        if (max_col - min_col + 1) * (max_row - min_row + 1) > len(self.cells):
+            # box covers more cells than are occupied, so scan the occupied ones
+            for (col, row), cell in self.cells.items():
+                if min_col <= col <= max_col and min_row <= row <= max_row:
+                    yield cell
+        else:
+            for col in range(min_col, max_col + 1):
+                for row in range(min_row, max_row + 1):
+                    cell = self.cells.get((col, row))
+                    if cell is not None:
+                        yield cell
+
+    def _bbox_positions(self, west, south, east, north):
+        """
+        Finds the positions of the points inside a bounding box
+        :return: list of point positions
+        """
+        if west > east:
+            return (self._bbox_positions(west, south, 180.0, north) +
+                    self._bbox_positions(-180.0, south, east, north))
+
+        xs = self.xs
+        ys = self.ys
+        found = []
+        for cell in self._cells_in(west, south, east, north):
+            for position in cell:
+                if west <= xs[position] <= east and south <= ys[position] <= north:
+                    found.append(position)
+        return found
+
+    def bbox(self, west, south, east, north):
+        """
+        Finds all points inside a bounding box. Boxes that cross the antimeridian (west > east) are supported.
+        :param west: Western bound (longitude)
+        :param south: Southern bound (latitude)
+        :param east: Eastern bound (longitude)
+        :param north: Northern bound (latitude)
+        :return: list of point ids
+        """
+        ids = self.ids
+        return [ids[position] for position in self._bbox_positions(west, south, east, north)]
+
+    def radius(self, x, y, meters):
+        """
+        Finds all points within a distance of a coordinate
+        :param x: longitude
+        :param y: latitude
+        :param meters: search radius in meters
+        :return: list of (point id, distance in meters), nearest first
+        """
+        # approximate radius of Earth in meters
+        r = 6373000.0
+
+        lat_range = degrees(meters / r)
+        south = max(y - lat_range, -90.0)
+        north = min(y + lat_range, 90.0)
+        lat_cos = min(cos(radians(south)), cos(radians(north)))
+        if lat_cos <= 0 or lat_range / lat_cos >= 180:
+            candidates = self._bbox_positions(-180.0, south, 180.0, north)
+        else:
+            lon_range = lat_range / lat_cos
+            west = x - lon_range
+            east = x + lon_range
+            if west < -180:
+                west += 360
+            if east > 180:
+                east -= 360
+            candidates = self._bbox_positions(west, south, east, north)
+
+        found = []
+        for position in candidates:
+            dist = GIS_Basics.coord_dist([x, y, self.xs[position], self.ys[position]])
+            if dist <= meters:
+                found.append((self.ids[position], dist))
+        found.sort(key=lambda pair: (pair[1], pair[0]))
+        return found
+
+    def nearest(self, x, y, k=1, max_dist=None):
+        """
+        Finds the k nearest points to a coordinate. The search radius doubles until k points are found.
+        :param x: longitude
+        :param y: latitude
+        :param k: number of points to find
+        :param max_dist: only return points within this many meters (Optional)
+        :return: list of up to k (point id, distance in meters), nearest first
+        """
+        # half of the Earth's circumference with the radius coord_dist uses
+        farthest = pi * 6373000.0
+        limit = farthest if max_dist is None else min(max_dist, farthest)
+        # cells hold about 8 points, so start near the spacing expected for k points
+        search = min(radians(self.cell_size) * 6373000.0 * sqrt(k / 8) / 2, limit)
+
+        while True:
+            found = self.radius(x, y, search)
+            if len(found) >= k or search >= limit:
+                return found[:k]
+            search = min(search * 2, limit)
+
+    def save(self, file_path):
+        """
+        Saves the index so it can be reused without rebuilding it
+        :param file_path: Path of file to write to
+        :return: Writes index to file
+        """
+        with open(file_path, "wb") as index_file:
+            pickle.dump(self, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Loads an index written by save
+        :param file_path: Path of index file
+        :return: GridIndex
+        """
+        with open(file_path, "rb") as index_file:
+            index = pickle.load(index_file)
+        if not isinstance(index, cls):
+            raise TypeError(str(file_path) + " does not contain a " + cls.__name__)
+        return index
+
+
+class BBoxIndex:
+    """
+    Spatial index of bounding boxes, such as the bounds of polygons. Each box is listed in every grid cell it overlaps.
+    Boxes wider or taller than max_cells cells are kept in a separate list that every lookup checks,
+    so a few very large boxes do not fill the grid.
+    Box ids are the positions of the boxes in the list the index was built from.
+    """
+
+    def __init__(self, bounds, cell_size=None, max_cells=4):
+        """
+        Builds the index
+        :param bounds: List of [west, south, east, north]
+        :param cell_size: Width of grid cells in degrees. Defaults to the median box size.
+        :param max_cells: Most cells a box can span in each direction before it is kept out of the grid
+        """
+        self.bounds = [tuple(box) for box in bounds]
+
+        if cell_size is None:
+            # the median is not pulled up by a few very large boxes like the mean is
+            sizes = sorted(max(box[2] - box[0], box[3] - box[1]) for box in self.bounds if box[2] >= box[0])
+            cell_size = sizes[len(sizes) // 2] if sizes else 1.0
+        self.cell_size = max(float(cell_size), 1e-6)
+
+        self.cells = {}
+        self.large = []
+        for box_id in range(len(self.bounds)):
+            west, south, east, north = self.bounds[box_id]
+            if (east - west) / self.cell_size > max_cells or (north - south) / self.cell_size > max_cells:
+                self.large.append(box_id)
+                continue
+            for col in range(floor(west / self.cell_size), floor(east / self.cell_size) + 1):
+                for row in range(floor(south / self.cell_size), floor(north / self.cell_size) + 1):
+                    cell = self.cells.get((col, row))
+                    if cell is None:
+                        self.cells[(col, row)] = [box_id]
+                    else:
+                        cell.append(box_id)
+
+    def __len__(self):
+        return len(self.bounds)
+
+    @classmethod
+    def from_rings(cls, rings, cell_size=None):
+        """
+        Builds an index of the bounds of polygon rings
+        :param rings: List of (array of x, array of y)
+        :param cell_size: Width of grid cells in degrees (Optional)
+        :return: BBoxIndex
+        """
+        bounds = []
+        for ring_xs, ring_ys in rings:
+            if len(ring_xs):
+                bounds.append([min(ring_xs), min(ring_ys), max(ring_xs), max(ring_ys)])
+            else:
+                # empty ring that no point can fall in
+                bounds.append([0.0, 0.0, -1.0, -1.0])
+        return cls(bounds, cell_size)
+
+    def point(self, x, y):
+        """
+        Finds the boxes that contain a point
+        :param x: longitude
+        :param y: latitude
+        :return: list of box ids, lowest first
+        """
+        found = []
+        for box_id in self.cells.get((floor(x / self.cell_size), floor(y / self.cell_size)), []):
+            west, south, east, north = self.bounds[box_id]
+            if west <= x <= east and south <= y <= north:
+                found.append(box_id)
+        if self.large:
+            for box_id in self.large:
+                west, south, east, north = self.bounds[box_id]
+                if west <= x <= east and south <= y <= north:
+                    found.append(box_id)
+            found.sort()
+        return found